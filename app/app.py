@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 from typing import Dict
 
 from openai import AsyncOpenAI
@@ -12,17 +13,40 @@ from openai.types.beta.threads import (
 import chainlit as cl
 from typing import Optional
 from chainlit.context import context
+from chainlit.server import app as server
+from chainlit.session import ws_sessions_id
+from starlette.responses import PlainTextResponse
 from decimal import Decimal
 
 import assistant_tools as at
 import prompts as pr
 import price_helper
 import consts
+from run_tracker import RunTracker, terminal_statuses
+from message_mirror import MessageMirror
+from run_state import SessionRunState
+from run_poller import create_run_poller
+from thread_pool import create_thread_pool
+from file_cache import file_cache
+from pf_auth import token_manager
+from pf_client import pf_http
+from pf_cache import pf_cache
+from pf_spatial import spatial_cache
+from completion_cache import completion_cache
+from image_store import image_store
+from runtime_stats import loop_monitor, memory_bytes
+from turn_profiler import turn_profiler
+from ui_updates import MessageUpdater
+import tracing
+from metrics import registry, run_api_calls_saved_total, run_api_calls_total, ui_updates_total
 
 
 api_key = os.environ.get("OPENAI_API_KEY")
 client = AsyncOpenAI(api_key=api_key)
 assistant_id = os.environ.get("ASSISTANT_ID")
+run_poller = create_run_poller(client)
+thread_pool = create_thread_pool(client)
+warm_up_task = None  # type: Optional[asyncio.Task]
 
 
 class DictToObject:
@@ -31,33 +55,44 @@ class DictToObject:
             setattr(self, key, value)
 
 
+async def retrieve_file_content(file_id: str) -> bytes:
+    response = await client.files.with_raw_response.retrieve_content(file_id)
+    return response.content
+
+
 async def process_thread_message(
-    message_references: Dict[str, cl.Message], thread_message: ThreadMessage
+    message_references: Dict[str, cl.Message],
+    thread_message: ThreadMessage,
+    updater: MessageUpdater,
 ):
     for idx, content_message in enumerate(thread_message.content):
         id = thread_message.id + str(idx)
         if isinstance(content_message, MessageContentText):
             if id in message_references:
-                msg = message_references[id]
-                msg.content = content_message.text.value
-                await msg.update()
+                await updater.set_content(
+                    message_references[id], content_message.text.value
+                )
             else:
                 message_references[id] = cl.Message(
                     author=thread_message.role, content=content_message.text.value
                 )
+                tracing.first_token()
                 await message_references[id].send()
+                updater.sent(message_references[id])
         elif isinstance(content_message, MessageContentImageFile):
-            image_id = content_message.image_file.file_id
-            response = await client.files.with_raw_response.retrieve_content(image_id)
-            elements = [
-                cl.Image(
-                    name=image_id,
-                    content=response.content,
-                    display="inline",
-                    size="large",
-                ),
-            ]
+            # Images do not change, only download the ones not shown yet
             if id not in message_references:
+                image_id = content_message.image_file.file_id
+                elements = [
+                    cl.Image(
+                        name=image_id,
+                        content=await file_cache.get_or_fetch(
+                            image_id, lambda: retrieve_file_content(image_id)
+                        ),
+                        display="inline",
+                        size="large",
+                    ),
+                ]
                 message_references[id] = cl.Message(
                     author=thread_message.role,
                     content="",
@@ -68,11 +103,152 @@ async def process_thread_message(
             print("unknown message type", type(content_message))
 
 
+async def send_story_chunks(story_chunks) -> str:
+    """
+    Start the story -> summarizer -> image chain of every chunk at once and render
+    them in chunk order. Tokens of a chunk that is not on screen yet are queued
+    and replayed as soon as the chunks before it are done.
+    Returns the story text of the last chunk.
+    """
+    semaphore = asyncio.Semaphore(consts.story_concurrency)
+    token_queues = [asyncio.Queue() for _ in story_chunks]
+    tasks = [
+        asyncio.create_task(
+            at.run_story_chain(
+                pr.prompts_list[i], story_chunks[i], token_queues[i], semaphore
+            )
+        )
+        for i in range(len(story_chunks))
+    ]
+
+    output = ""
+    try:
+        for i in range(len(story_chunks)):
+            output = ""
+            msg = cl.Message(content="")
+            await msg.send()
+
+            while (token := await token_queues[i].get()) is not None:
+                output += token
+                tracing.first_token()
+                await msg.stream_token(token)
+
+            await msg.update()
+
+            # uncomment this line/ switch with at.run_story_chain to run stable diffusion XL with GPU
+            # img = cl.Image(
+            #     content=at.get_image_response_SDXL(
+            #         at.summarizer(output)
+            #     ),
+            #     name="image1",
+            #     display="inline",
+            #     size="large",
+            # )  # _SDXL
+            image_path, generated = await tasks[i]
+            # Images served from the image store cost nothing
+            if generated:
+                generated_image_count = cl.user_session.get("generated_image_count")
+                generated_image_count += 1
+                cl.user_session.set("generated_image_count", generated_image_count)
+
+            img = cl.Image(
+                path=image_path,
+                name="image1",
+                display="inline",
+                size="large",
+            )
+            image_message_to_assistant = cl.Message(
+                author="Climate Change Assistant",
+                content=" ",
+                elements=[img],
+            )
+            await image_message_to_assistant.send()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return output
+
+
+async def warm_up():
+    """
+    Do the first-use work of the process while the first user is still typing:
+    the tools' OpenAI client, the Probable Futures token, the thread pool and,
+    in dev mode, the tokenizer of the cost report.
+    """
+    at.openai_client()
+    thread_pool.refill()
+    jobs = [token_manager.get_token()]
+    if consts.is_dev:
+        jobs.append(asyncio.to_thread(price_helper.warm_up))
+    for result in await asyncio.gather(*jobs, return_exceptions=True):
+        if isinstance(result, Exception):
+            print("Warm up failed:", repr(result))
+
+
+def process_stats():
+    return {"sessions": len(ws_sessions_id), "memory_bytes": memory_bytes()}
+
+
+stats_sources = {
+    "process": process_stats,
+    "loop_lag": loop_monitor.stats,
+    "run_poller": run_poller.stats,
+    "thread_pool": thread_pool.stats,
+    "location_prefetch": at.location_prefetcher.stats,
+    "pf_http": pf_http.stats,
+    "pf_token": token_manager.stats,
+    "pf_cache": pf_cache.stats,
+    "spatial_cache": spatial_cache.stats,
+    "completion_cache": completion_cache.stats,
+    "image_store": image_store.stats,
+    "file_cache": file_cache.stats,
+    "profiler": turn_profiler.stats,
+}
+for name, stats in stats_sources.items():
+    registry.collect(name, stats)
+
+if consts.debug_stats:
+
+    @server.get("/debug/stats")
+    async def debug_stats():
+        loop_monitor.start()
+        return {name: stats() for name, stats in stats_sources.items()}
+
+    @server.post("/debug/profile/{thread_id}")
+    async def start_profiling(thread_id: str):
+        # Every following turn of the thread is profiled until it is deleted again
+        turn_profiler.threads.add(thread_id)
+        return {"profiled_threads": sorted(turn_profiler.threads)}
+
+    @server.delete("/debug/profile/{thread_id}")
+    async def stop_profiling(thread_id: str):
+        turn_profiler.threads.discard(thread_id)
+        return {"profiled_threads": sorted(turn_profiler.threads)}
+
+
+if consts.metrics_endpoint:
+
+    @server.get("/metrics")
+    async def metrics():
+        loop_monitor.start()
+        return PlainTextResponse(
+            registry.render(), media_type="text/plain; version=0.0.4"
+        )
+
+
 @cl.on_chat_start
 async def start_chat():
-    thread = await client.beta.threads.create()
-    cl.user_session.set("thread", thread)
+    global warm_up_task
+    if warm_up_task is None:
+        warm_up_task = asyncio.create_task(warm_up())
+    if consts.debug_stats or consts.metrics_endpoint:
+        loop_monitor.start()
+
+    # The thread is only claimed with the first message, see run_conversation
     cl.user_session.set("generated_image_count", 0)
+    cl.user_session.set("token_ledger", price_helper.TokenLedger())
+    cl.user_session.set("run_state", SessionRunState())
     await cl.Message(
         author="Climate Change Assistant",
         content="Hi! I'm your climate change assistant to help you prepare. What location are you interested in?",
@@ -80,70 +256,77 @@ async def start_chat():
 
 
 @cl.on_message
+@turn_profiler.profile_calls(lambda: getattr(cl.user_session.get("thread"), "id", None))
 async def run_conversation(message_from_ui: cl.Message):
-    thread = cl.user_session.get("thread")  # type: Thread
-
-    # Wait until the run is done (cancelled, failed, completed, expired)
-    while True:
-        runs = await client.beta.threads.runs.list(thread_id=thread.id)
-        is_completed = True
-        for run in runs.data:
-            if run.status == "requires_action":
-                await client.beta.threads.runs.cancel(
-                    thread_id=thread.id, run_id=run.id
-                )
-            elif run.status not in [
-                "cancelled",
-                "failed",
-                "completed",
-                "expired",
-            ]:
-                is_completed = False
-                break
-        if is_completed is True:
-            break
-        await cl.sleep(1)
+    thread = cl.user_session.get("thread")  # type: Optional[Thread]
+    trace = tracing.start_trace(getattr(thread, "id", None))
+    if consts.prefetch_locations:
+        at.location_prefetcher.prefetch(message_from_ui.content)
+    if thread is None:
+        # Sessions that never send a message never cost a thread
+        with tracing.span("thread_claim"):
+            thread = await thread_pool.claim()
+        trace.trace_id = thread.id
+        cl.user_session.set("thread", thread)
+        cl.user_session.set("message_mirror", MessageMirror(client, thread.id))
+    mirror = cl.user_session.get("message_mirror")  # type: MessageMirror
+
+    # Wait until the previous run is done (cancelled, failed, completed, expired).
+    # Sessions without a recorded state have to ask the API which runs are active.
+    run_state = cl.user_session.get("run_state") or SessionRunState(certain=False)
+    cl.user_session.set("run_state", run_state)
+    with tracing.span("wait_idle"):
+        await run_state.wait_until_idle(client, thread.id, run_poller)
 
     # Add the message to the thread
-    await client.beta.threads.messages.create(
-        thread_id=thread.id, role="user", content=message_from_ui.content
-    )
+    with tracing.span("message_create"):
+        user_message = await client.beta.threads.messages.create(
+            thread_id=thread.id, role="user", content=message_from_ui.content
+        )
+    mirror.upsert(user_message, settled=True)
 
     # Send empty message to display the loader
     loader_msg = cl.Message(author="assistant", content="")
     await loader_msg.send()
 
     # Create the run
-    run = await client.beta.threads.runs.create(
-        thread_id=thread.id, assistant_id=assistant_id
-    )
+    with tracing.span("run_create"):
+        run = await client.beta.threads.runs.create(
+            thread_id=thread.id, assistant_id=assistant_id
+        )
 
     message_references = {}  # type: Dict[str, cl.Message]
+    updater = MessageUpdater()
+    run_state.start(run.id)
+    tracker = RunTracker(client, thread.id, run.id, poller=run_poller)
 
     # Periodically check for updates
     while True:
-        run = await client.beta.threads.runs.retrieve(
-            thread_id=thread.id, run_id=run.id
-        )
+        run = await tracker.retrieve_run()
+        run_state.update(run)
 
-        # Fetch the run steps
-        run_steps = await client.beta.threads.runs.steps.list(
-            thread_id=thread.id, run_id=run.id, order="asc"
-        )
+        # Only the steps that are new or still changing come back from the tracker
+        steps = await tracker.changed_steps()
+        # One messages.list brings every message of these steps into the mirror
+        if any(step.step_details.type == "message_creation" for step in steps):
+            await tracker.sync_messages(mirror)
 
-        for step in run_steps.data:
-            # Fetch step details
-            run_step = await client.beta.threads.runs.steps.retrieve(
-                thread_id=thread.id, run_id=run.id, step_id=step.id
-            )
-            step_details = run_step.step_details
+        for step in steps:
+            step_details = step.step_details
             # Update step content in the Chainlit UI
             if step_details.type == "message_creation":
-                thread_message = await client.beta.threads.messages.retrieve(
-                    message_id=step_details.message_creation.message_id,
-                    thread_id=thread.id,
+                message_id = step_details.message_creation.message_id
+                thread_message = mirror.messages.get(message_id)
+                if thread_message is None:
+                    # Not listed yet, e.g. right after the step was created
+                    thread_message = await tracker.retrieve_message(message_id)
+                    mirror.upsert(thread_message)
+                # The content fetched after the step finished is final
+                if step.status in terminal_statuses:
+                    mirror.settle(message_id)
+                await process_thread_message(
+                    message_references, thread_message, updater
                 )
-                await process_thread_message(message_references, thread_message)
 
             if step_details.type == "tool_calls":
                 # loading_message = "Retrieving information, please stand by."
@@ -174,12 +357,13 @@ async def run_conversation(message_from_ui: cl.Message):
                                 parent_id=context.session.root_message.id,
                             )
                             await message_references[tool_call.id].send()
+                            updater.sent(message_references[tool_call.id])
                         else:
-                            message_references[tool_call.id].content = (
+                            await updater.set_content(
+                                message_references[tool_call.id],
                                 tool_call.code_interpreter.input
-                                or "# Generating code..."
+                                or "# Generating code...",
                             )
-                            await message_references[tool_call.id].update()
 
                         tool_output_id = tool_call.id + "output"
 
@@ -191,11 +375,12 @@ async def run_conversation(message_from_ui: cl.Message):
                                 parent_id=context.session.root_message.id,
                             )
                             await message_references[tool_output_id].send()
+                            updater.sent(message_references[tool_output_id])
                         else:
-                            message_references[tool_output_id].content = (
-                                str(tool_call.code_interpreter.outputs) or ""
+                            await updater.set_content(
+                                message_references[tool_output_id],
+                                str(tool_call.code_interpreter.outputs) or "",
                             )
-                            await message_references[tool_output_id].update()
 
                     elif tool_call.type == "retrieval":
                         if not tool_call.id in message_references:
@@ -231,7 +416,9 @@ async def run_conversation(message_from_ui: cl.Message):
                             # Not sure why, but sometimes this is returned rather than name
                             function_name = function_name.replace("_schema", "")
 
-                            summary, parsed_output = function_mappings[function_name](
+                            summary, parsed_output = await function_mappings[
+                                function_name
+                            ](
                                 **function_args
                             )  # , output, image
 
@@ -250,9 +437,10 @@ async def run_conversation(message_from_ui: cl.Message):
 
                                 output = ""
 
-                                for part in summary:
-                                    if token := part.choices[0].delta.content or "":
+                                with tracing.span("summary_stream"):
+                                    async for token in summary:
                                         output += token
+                                        tracing.first_token()
                                         await msg.stream_token(token)
 
                                 await msg.update()
@@ -274,86 +462,46 @@ async def run_conversation(message_from_ui: cl.Message):
                                     land_output,
                                 ]
 
-                                # iterating through this list
-                                for i in range(len(story_chunks)):
-                                    output = ""
-                                    story = at.story_completion(
-                                        pr.prompts_list[i], story_chunks[i]
-                                    )
-
-                                    msg = cl.Message(content="")
-                                    await msg.send()
-
-                                    for part in story:
-                                        if token := part.choices[0].delta.content or "":
-                                            output += token
-                                            await msg.stream_token(token)
-
-                                    await msg.update()
-
-                                    # loading_message_to_assistant = cl.Message(author="assistant",
-                                    #                                          content=output)
-                                    # await loading_message_to_assistant.send()
-
-                                    # await cl.sleep(10)
-
-                                    generated_image_count = cl.user_session.get(
-                                        "generated_image_count"
-                                    )
-                                    generated_image_count += 1
-                                    cl.user_session.set(
-                                        "generated_image_count", generated_image_count
-                                    )
-
-                                    # uncomment this line/ switch with 283 to run stable diffusion XL with GPU
-                                    # img = cl.Image(
-                                    #     content=at.get_image_response_SDXL(
-                                    #         at.summarizer(output)
-                                    #     ),
-                                    #     name="image1",
-                                    #     display="inline",
-                                    #     size="large",
-                                    # )  # _SDXL
-                                    img = cl.Image(
-                                        url=at.get_image_response(
-                                            pr.storyboard_prompt, at.summarizer(output)
-                                        ),
-                                        name="image1",
-                                        display="inline",
-                                        size="large",
-                                    )
-                                    image_message_to_assistant = cl.Message(
-                                        author="Climate Change Assistant",
-                                        content=" ",
-                                        elements=[img],
-                                    )
-                                    await image_message_to_assistant.send()  # output_message_to_assistant.send()
-
-                            await client.beta.threads.runs.submit_tool_outputs(
-                                thread_id=thread.id,
-                                run_id=run.id,
-                                tool_outputs=[
-                                    {
-                                        "tool_call_id": tool_call.id,
-                                        "output": output,
-                                    },
-                                ],
-                            )
-
-        await cl.sleep(1)  # Refresh every second
+                                # All chunks are generated concurrently and shown in order
+                                output = await send_story_chunks(story_chunks)
+
+                            with tracing.span("submit_tool_outputs"):
+                                await client.beta.threads.runs.submit_tool_outputs(
+                                    thread_id=thread.id,
+                                    run_id=run.id,
+                                    tool_outputs=[
+                                        {
+                                            "tool_call_id": tool_call.id,
+                                            "output": output,
+                                        },
+                                    ],
+                                )
 
-        if run.status in ["cancelled", "failed", "completed", "expired"]:
+        # The next tracker.retrieve_run() waits for the shared poller, no sleep needed
+        if run.status in terminal_statuses:
+            await updater.finish()
+            tracing.end_trace(trace, run.status)
+            ui_updates_total.inc(updater.updates, kind="full")
+            ui_updates_total.inc(updater.deltas, kind="delta")
+            ui_updates_total.inc(updater.suppressed, kind="suppressed")
+            run_api_calls_total.inc(tracker.api_calls)
+            run_api_calls_saved_total.inc(tracker.saved_api_calls)
+            if consts.turn_reports:
+                print(tracker.report())
+                print(updater.report())
+                print(trace.report())
+            # Pick up any message the steps did not show, without listing the thread
+            await mirror.sync(settled=True)
             if consts.is_dev:
                 image_count = cl.user_session.get("generated_image_count")
 
-                all_messages = await client.beta.threads.messages.list(
-                    thread_id=thread.id
-                )
-                [input_tokens, output_tokens] = price_helper.tokens_per_user(
-                    all_messages.data[2:]
+                all_messages = mirror.newest_first()
+                token_ledger = cl.user_session.get("token_ledger")
+                [input_tokens, output_tokens] = token_ledger.tokens_per_user(
+                    all_messages[2:]
                 )  # skip last two messages
                 [tokens_for_last_input_message, tokens_for_last_output_message] = (
-                    price_helper.tokens_per_user(all_messages.data[:2])
+                    token_ledger.tokens_per_user(all_messages[:2])
                 )  # tokens of the last 2 messages (top of the list are the latest messages)
                 cost = sum(
                     [
@@ -1,9 +1,7 @@
 import os
 import json
-import pandas as pd
 
-import requests
-from openai import OpenAI
+from openai import AsyncOpenAI
 from datetime import date
 from datetime import datetime
 
@@ -19,13 +17,28 @@ import urllib
 # import torch
 
 import prompts as pr
-
-pf_api_url = os.getenv("PF_API_URL")
-pf_token_audience = os.getenv("PF_TOKEN_AUDIENCE")
-pf_token_url = os.getenv("PF_TOKEN_URL")
+import consts
+import tracing
+from pf_auth import token_manager
+from pf_client import pf_http
+from pf_cache import pf_cache, cache_key, location_key, scenario_key
+from pf_spatial import spatial_cache
+from pf_records import StatTable, parse_statistics
+from location_prefetch import create_location_prefetcher, gazetteer
+from dataset_catalog import dataset_catalog, story_categories
+from completion_cache import completion_cache, completion_key
+from image_store import image_key, image_store
 
 load_dotenv()
-client = OpenAI()
+_client = None
+
+
+def openai_client() -> AsyncOpenAI:
+    """OpenAI client of the tools, built on first use so importing stays fast."""
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI()
+    return _client
 
 # gpu = torch.cuda.is_available()
 # if gpu:
@@ -57,81 +70,53 @@ def convert_to_iso8601(date_str):
         return date_str
 
 
-def get_current_datetime():
+async def get_current_datetime():
     return str(date.today())
 
 
-def get_pf_token():
-    client_id = os.getenv("CLIENT_ID")
-    client_secret = os.getenv("CLIENT_SECRET")
-    response = requests.post(
-        pf_token_url,
-        json={
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "audience": pf_token_audience,
-            "grant_type": "client_credentials",
-        },
-    )
-    access_token = response.json()["access_token"]
-    return access_token
-
-
-def json_to_dataframe(json_data, address, country):
-    # Extract the relevant part of the JSON data
-    json_data = json.loads(json_data)
-    data = json_data["data"]["getDatasetStatistics"]["datasetStatisticsResponses"]
-    # Convert to a DataFrame
-    df = pd.DataFrame(data)
-    # Normalize the 'info' column if needed
-    if not df["info"].apply(lambda x: x == {}).all():
-        info_df = pd.json_normalize(df["info"])
-        df = df.drop(columns=["info"]).join(info_df)
-    df["address"] = address
-    df["country"] = country
-    df = df[["address", "country", "name", "midValue", "unit"]]
-    df = df[df["name"].str.contains("Change")]
-    df = df[~(df["midValue"] == "0.0")]
-    df.reset_index(drop=True, inplace=True)
-    return df
+async def get_pf_token():
+    return await token_manager.get_token()
 
 
 def story_splitter(parsed_output):
-    temperature_output = parsed_output[
-        parsed_output.name.str.contains("nights|balance|dry hot")
-    ]
-    water_output = parsed_output[
-        parsed_output.name.str.contains("annual|wettest|frequency")
-    ]
-    land_output = parsed_output[parsed_output.name.str.contains("drought|wildfire")]
+    groups = dataset_catalog.split(parsed_output)
+    temperature_output, water_output, land_output = (
+        StatTable(groups[category]) for category in story_categories
+    )
 
     return temperature_output, water_output, land_output
 
 
 def summary_completion(content):
-    completion = client.chat.completions.create(
-        model="gpt-4-0125-preview",  # gpt-4 #gpt-3.5-turbo-16k
-        messages=[
-            {"role": "system", "content": pr.summary_system_prompt},
-            {"role": "user", "content": content},
-        ],
-        stream=True,
-    )
+    model = "gpt-4-0125-preview"  # gpt-4 #gpt-3.5-turbo-16k
+    messages = [
+        {"role": "system", "content": pr.summary_system_prompt},
+        {"role": "user", "content": content},
+    ]
 
-    return completion  # .choices[0].message.content
+    # Async iterator over the text tokens, replayed from the cache for repeat prompts
+    return completion_cache.stream(
+        completion_key(model, pr.summary_system_prompt, content),
+        lambda: openai_client().chat.completions.create(
+            model=model, messages=messages, stream=True
+        ),
+    )
 
 
 def story_completion(story_system_prompt, content):
-    completion = client.chat.completions.create(
-        model="gpt-4-0125-preview",  # gpt-4 #gpt-3.5-turbo-16k
-        messages=[
-            {"role": "system", "content": story_system_prompt},
-            {"role": "user", "content": str(content.to_json())},
-        ],
-        stream=True,
-    )
+    model = "gpt-4-0125-preview"  # gpt-4 #gpt-3.5-turbo-16k
+    content = str(content.to_json())
+    messages = [
+        {"role": "system", "content": story_system_prompt},
+        {"role": "user", "content": content},
+    ]
 
-    return completion  # .choices[0].message.content
+    return completion_cache.stream(
+        completion_key(model, story_system_prompt, content),
+        lambda: openai_client().chat.completions.create(
+            model=model, messages=messages, stream=True
+        ),
+    )
 
 
 # need GPU to run this part; uncomment lines 31 & 32
@@ -152,41 +137,52 @@ def story_completion(story_system_prompt, content):
 
 
 # dall-e-3 image completion version
-def get_image_response(storyboard_prompt, prompt):
+async def get_image_response(storyboard_prompt, prompt):
     print(storyboard_prompt + " " + "\nSTORY CHUNK:" + "\n" + prompt)
-    response = client.images.generate(
-        model="dall-e-3",
-        prompt=storyboard_prompt
-        + "\n---------"
-        + "\nSTORY CHUNK:"
-        + "\n"
-        + prompt,  # "a white siamese cat"
-        size="1024x1024",
-        quality="standard",
-        n=1,
-    )
+    with tracing.span("image_generation"):
+        response = await openai_client().images.generate(
+            model="dall-e-3",
+            prompt=storyboard_prompt
+            + "\n---------"
+            + "\nSTORY CHUNK:"
+            + "\n"
+            + prompt,  # "a white siamese cat"
+            size="1024x1024",
+            quality="standard",
+            n=1,
+        )
 
     return response.data[0].url
 
 
-def get_pf_data_new(address, country, warming_scenario="2.0"):
-    variables = {}
+async def get_image_path(storyboard_prompt, prompt):
+    # Generated once per storyboard prompt and summary, then served from disk
+    return await image_store.get_or_generate(
+        image_key(storyboard_prompt, prompt),
+        lambda: get_image_response(storyboard_prompt, prompt),
+    )
+
 
-    location = f"""
-        country: "{country}"
-        address: "{address}"
+async def run_story_chain(story_system_prompt, content, tokens, semaphore):
     """
+    Stream one story chunk into the `tokens` queue, then summarize it and generate
+    its image. A None sentinel marks the end of the story even on failure.
+    Returns the local path of the image and whether it was generated for this call.
+    """
+    async with semaphore:
+        output = ""
+        try:
+            with tracing.span("story_stream"):
+                async for token in story_completion(story_system_prompt, content):
+                    output += token
+                    tokens.put_nowait(token)
+        finally:
+            tokens.put_nowait(None)
+
+        return await get_image_path(pr.storyboard_prompt, await summarizer(output))
 
-    query = (
-        """
-            mutation {
-                getDatasetStatistics(input: { """
-        + location
-        + """ \
-                    warmingScenario: \""""
-        + warming_scenario
-        + """\"
-                }) {
+
+statistics_fields = """
                 datasetStatisticsResponses{
                     datasetId
                     midValue
@@ -196,42 +192,152 @@ def get_pf_data_new(address, country, warming_scenario="2.0"):
                     latitude
                     longitude
                     info
-                }
-            }
-        }
-    """
-    )
+                }"""
+
+
+def scenario_alias(warming_scenario):
+    return "scenario_" + scenario_key(warming_scenario).replace(".", "_")
+
+
+def build_statistics_query(address, country, warming_scenarios):
+    # One getDatasetStatistics mutation per scenario, aliased so they can share a document
+    mutations = ""
+    for warming_scenario in warming_scenarios:
+        mutations += f"""
+            {scenario_alias(warming_scenario)}: getDatasetStatistics(input: {{
+                country: {json.dumps(str(country))}
+                address: {json.dumps(str(address))}
+                warmingScenario: {json.dumps(str(warming_scenario))}
+            }}) {{{statistics_fields}
+            }}"""
+    return "mutation {" + mutations + "\n}"
+
+
+async def get_cached_statistics(address, country, warming_scenario):
+    # Served locally when the address, or its grid cell, was resolved before
+    data = await spatial_cache.get(address, country, warming_scenario)
+    if data is None:
+        # A new spelling of a known city, or a city in a cell fetched for another place
+        place = gazetteer.lookup(address, country)
+        if place is not None:
+            data = await spatial_cache.get_by_coordinates(
+                address, country, place.latitude, place.longitude, warming_scenario
+            )
+    if data is None:
+        data = await pf_cache.get(cache_key(address, country, warming_scenario))
+    return data
+
+
+async def store_statistics(address, country, results):
+    """Cache the data of every warming scenario in `results` in one write."""
+    items = {}
+    for warming_scenario, data in results.items():
+        # Results without coordinates can only be cached under the address itself
+        items.update(
+            spatial_cache.entries(address, country, warming_scenario, data)
+            or {cache_key(address, country, warming_scenario): data}
+        )
+    await pf_cache.set_many(items)
+
+
+async def post_statistics_query(query):
+    variables = {}
 
-    access_token = get_pf_token()
-    url = pf_api_url + "/graphql"
-    headers = {"Authorization": "Bearer " + access_token}
-    response = requests.post(
-        url, json={"query": query, "variables": variables}, headers=headers
+    for attempt in range(2):
+        access_token = await get_pf_token()
+        with tracing.span("pf_graphql"):
+            response = await pf_http.graphql(query, variables, access_token)
+        # The cached token may have been revoked before it expired
+        if response.status_code != 401:
+            break
+        token_manager.invalidate()
+
+    return response.json().get("data") or {}
+
+
+async def fetch_dataset_statistics(address, country, warming_scenario="2.0"):
+    data = await get_cached_statistics(address, country, warming_scenario)
+    if data is not None:
+        return data
+
+    # Fetch the other scenarios in the same request so that switching or comparing
+    # scenarios in a later turn is answered from the cache
+    warming_scenarios = [warming_scenario]
+    if consts.prefetch_scenarios:
+        for scenario in consts.warming_scenarios:
+            if (
+                scenario_key(scenario) != scenario_key(warming_scenario)
+                and await get_cached_statistics(address, country, scenario) is None
+            ):
+                warming_scenarios.append(scenario)
+
+    results = await post_statistics_query(
+        build_statistics_query(address, country, warming_scenarios)
     )
+    if results.get(scenario_alias(warming_scenario)) is None and len(warming_scenarios) > 1:
+        # Fall back to the requested scenario alone if the batch was rejected
+        results = await post_statistics_query(
+            build_statistics_query(address, country, [warming_scenario])
+        )
+
+    await store_statistics(
+        address,
+        country,
+        {
+            scenario: results[scenario_alias(scenario)]["datasetStatisticsResponses"]
+            for scenario in warming_scenarios
+            if results.get(scenario_alias(scenario)) is not None
+        },
+    )
+
+    return results[scenario_alias(warming_scenario)]["datasetStatisticsResponses"]
+
 
-    response = str(response.json()).replace("'", '"')
+# Started from the user's message, before the assistant asks for the data
+location_prefetcher = create_location_prefetcher(fetch_dataset_statistics)
 
-    parsed_output = json_to_dataframe(response, address=address, country=country)
+
+async def get_pf_data_new(address, country, warming_scenario="2.0"):
+    place = await location_prefetcher.claim(address, country)
+    if place is not None:
+        # The prefetch cached the data under the gazetteer's spelling of the place
+        data = await fetch_dataset_statistics(place.address, place.country, warming_scenario)
+        if location_key(address, country) != place.key:
+            await store_statistics(address, country, {warming_scenario: data})
+    else:
+        data = await fetch_dataset_statistics(address, country, warming_scenario)
+
+    with tracing.span("parse_statistics"):
+        parsed_output = parse_statistics(data, address=address, country=country)
 
     summary = summary_completion(str(address) + " " + str(country))
 
     return summary, parsed_output
 
 
-def summarizer(content):
-    completion = client.chat.completions.create(
-        model="gpt-3.5-turbo-16k",  # gpt-4 # gpt-4-0125-preview
-        messages=[
-            {"role": "system", "content": pr.summarizer_prompt},
-            {"role": "user", "content": content},
-        ],
-        stream=False,
-    )
+async def summarizer(content):
+    model = "gpt-3.5-turbo-16k"  # gpt-4 # gpt-4-0125-preview
+    key = completion_key(model, pr.summarizer_prompt, content)
+    cached = completion_cache.get(key)
+    if cached is not None:
+        summary = "".join(cached)
+    else:
+        with tracing.span("summarizer"):
+            completion = await openai_client().chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": pr.summarizer_prompt},
+                    {"role": "user", "content": content},
+                ],
+                stream=False,
+            )
+        summary = str(completion.choices[0].message.content)
+        completion_cache.set(key, (summary,))
     print(
-        str(completion.choices[0].message.content)
+        summary
         + " centered, ominous, eerie, highly detailed, digital painting, artstation, concept art, smooth, sharp focus, illustration"
     )
     return (
-        str(completion.choices[0].message.content)
+        summary
         + " centered, ominous, eerie, highly detailed, digital painting, artstation, concept art, smooth, sharp focus, illustration"
     )
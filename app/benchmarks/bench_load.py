@@ -0,0 +1,354 @@
+"""
+Load test: many concurrent Chainlit sessions against one app server.
+
+Starts the fake services and `chainlit run app.py` (with DEBUG_STATS=true), then
+for every concurrency level opens that many websocket sessions, arriving at
+`--arrival-rate` sessions per second. Each session asks about `--turns` locations
+like the UI does. Reported per level: turn latency percentiles, time to first
+token, error rate, the server's event loop lag and its memory per session.
+
+Run from the app directory: `python -m benchmarks.bench_load --levels 1,5,10,20`
+
+To load a container of app/Dockerfile instead, start the fake services where the
+container can reach them (`python -m benchmarks.fake_services --host 0.0.0.0`),
+run the image with OPENAI_BASE_URL, PF_API_URL and PF_TOKEN_URL pointing at them
+(see `service_env` in fake_services.py), DEBUG_STATS=true and a known
+CHAINLIT_AUTH_SECRET, then pass `--url http://127.0.0.1:8080 --secret SECRET`.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import httpx
+import socketio
+
+from benchmarks.bench_startup import placeholder_env
+from benchmarks.bench_turns import turn_location
+from benchmarks.fake_services import (
+    add_latency_arguments,
+    app_directory,
+    free_port,
+    latency_arguments,
+    running,
+    service_env,
+)
+
+
+class SessionResult:
+    def __init__(self):
+        self.turn_latencies = []
+        self.first_token_latencies = []
+        self.errors = []
+
+
+class LoadSession:
+    """One simulated user: a websocket session sending its turns one by one."""
+
+    def __init__(self, url: str, token: str, turn_timeout: float):
+        self.url = url
+        self.token = token
+        self.turn_timeout = turn_timeout
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.result = SessionResult()
+        self.first_content_at = None
+        # Set when on_chat_start is done, its task_end comes after the greeting
+        self.ready = asyncio.Event()
+        self.turn_done = asyncio.Event()
+        self.client.on("new_message", self.on_message)
+        self.client.on("update_message", self.on_message)
+        self.client.on("stream_token", self.on_token)
+        self.client.on("task_end", self.on_task_end)
+
+    async def on_message(self, msg_dict):
+        if msg_dict.get("author") == "Error":
+            self.result.errors.append(msg_dict.get("content") or "error message")
+        if msg_dict.get("content"):
+            self.content_shown()
+
+    async def on_token(self, data):
+        if data.get("token"):
+            self.content_shown()
+
+    async def on_task_end(self, data):
+        if not self.ready.is_set():
+            self.ready.set()
+        else:
+            self.turn_done.set()
+
+    def content_shown(self):
+        if self.first_content_at is None:
+            self.first_content_at = time.perf_counter()
+
+    async def run(self, turns: int, first_turn: int) -> SessionResult:
+        try:
+            await self.client.connect(
+                self.url,
+                headers={
+                    "Authorization": "Bearer " + self.token,
+                    "X-Chainlit-Session-Id": str(uuid.uuid4()),
+                },
+                transports=["websocket"],
+                socketio_path="/ws/socket.io",
+            )
+            await self.client.emit("connection_successful")
+            await asyncio.wait_for(self.ready.wait(), self.turn_timeout)
+            for index in range(first_turn, first_turn + turns):
+                await self.turn(turn_location(index))
+        except Exception as e:
+            self.result.errors.append(repr(e))
+        finally:
+            with contextlib.suppress(Exception):
+                # Free the server side session now instead of after its timeout
+                await self.client.emit("clear_session")
+                await self.client.disconnect()
+        return self.result
+
+    async def turn(self, content: str):
+        self.first_content_at = None
+        self.turn_done.clear()
+        started = time.perf_counter()
+        await self.client.emit(
+            "ui_message",
+            {
+                "message": {
+                    "id": str(uuid.uuid4()),
+                    "author": "load-test",
+                    "content": content,
+                    "authorIsUser": True,
+                    "createdAt": datetime.now(timezone.utc).isoformat(),
+                },
+                "files": None,
+            },
+        )
+        await asyncio.wait_for(self.turn_done.wait(), self.turn_timeout)
+        self.result.turn_latencies.append(time.perf_counter() - started)
+        if self.first_content_at is not None:
+            self.result.first_token_latencies.append(self.first_content_at - started)
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def access_token(secret: str, username: str) -> str:
+    """A login token like the one Chainlit issues after the OAuth flow."""
+    return jwt.encode(
+        {
+            "username": username,
+            "role": "USER",
+            "tags": [],
+            "image": None,
+            "provider": "auth0",
+            "exp": datetime.utcnow() + timedelta(hours=1),
+        },
+        secret,
+        algorithm="HS256",
+    )
+
+
+class StatsSampler:
+    """Polls the server's /debug/stats while a level runs."""
+
+    def __init__(self, url: str, interval: float = 0.5):
+        self.url = url + "/debug/stats"
+        self.interval = interval
+        self.samples = []
+
+    async def fetch(self, http_client: httpx.AsyncClient):
+        try:
+            response = await http_client.get(self.url, timeout=5)
+            if response.headers.get("content-type", "").startswith("application/json"):
+                return response.json()
+        except httpx.HTTPError:
+            pass
+        return None
+
+    async def run(self, stop: asyncio.Event):
+        async with httpx.AsyncClient() as http_client:
+            while not stop.is_set():
+                sample = await self.fetch(http_client)
+                if sample is not None:
+                    self.samples.append(sample)
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stop.wait(), self.interval)
+
+
+async def run_level(url: str, secret: str, sessions: int, args) -> dict:
+    sampler = StatsSampler(url)
+    async with httpx.AsyncClient() as http_client:
+        baseline = await sampler.fetch(http_client)
+    stop = asyncio.Event()
+    sampling = asyncio.create_task(sampler.run(stop))
+
+    randomness = random.Random(sessions)
+    started = time.perf_counter()
+    tasks = []
+    for index in range(sessions):
+        session = LoadSession(
+            url, access_token(secret, "load-{}".format(index)), args.turn_timeout
+        )
+        tasks.append(asyncio.create_task(session.run(args.turns, index * args.turns)))
+        # Poisson arrivals at the requested rate
+        await asyncio.sleep(randomness.expovariate(args.arrival_rate))
+    results = await asyncio.gather(*tasks)
+    duration = time.perf_counter() - started
+    stop.set()
+    await sampling
+
+    turn_latencies = [latency for r in results for latency in r.turn_latencies]
+    first_tokens = [latency for r in results for latency in r.first_token_latencies]
+    errors = [error for r in results for error in r.errors]
+    attempted = sessions * args.turns
+    level = {
+        "sessions": sessions,
+        "duration": duration,
+        "turns": len(turn_latencies),
+        "errors": len(errors),
+        "error_rate": (attempted - len(turn_latencies)) / attempted,
+        "turn_p50": percentile(turn_latencies, 0.5),
+        "turn_p95": percentile(turn_latencies, 0.95),
+        "turn_p99": percentile(turn_latencies, 0.99),
+        "ttft_p50": percentile(first_tokens, 0.5),
+        "ttft_p95": percentile(first_tokens, 0.95),
+        "loop_lag_p99": None,
+        "loop_lag_max": None,
+        "memory_per_session": None,
+        "first_errors": errors[:3],
+    }
+    if sampler.samples:
+        level["loop_lag_p99"] = max(s["loop_lag"]["p99"] for s in sampler.samples)
+        level["loop_lag_max"] = max(s["loop_lag"]["max"] for s in sampler.samples)
+        if baseline is not None:
+            peak = max(s["process"]["memory_bytes"] for s in sampler.samples)
+            level["memory_per_session"] = (peak - baseline["process"]["memory_bytes"]) / sessions
+    return level
+
+
+def print_level(level: dict):
+    def seconds(value):
+        return "   n/a" if value is None else "{:6.3f}".format(value)
+
+    memory = level["memory_per_session"]
+    print(
+        "{:>8} {:>6} {:>6.1%} {} {} {} {} {} {} {:>10}".format(
+            level["sessions"],
+            level["turns"],
+            level["error_rate"],
+            seconds(level["turn_p50"]),
+            seconds(level["turn_p95"]),
+            seconds(level["turn_p99"]),
+            seconds(level["ttft_p50"]),
+            seconds(level["loop_lag_p99"]),
+            seconds(level["loop_lag_max"]),
+            "n/a" if memory is None else "{:.0f} KiB".format(memory / 1024),
+        )
+    )
+    for error in level["first_errors"]:
+        print("         error:", error)
+
+
+@contextlib.contextmanager
+def app_server(base_url: str, secret: str, port: int, directory: str):
+    """Run `chainlit run app.py` against the fake services."""
+    env = dict(os.environ)
+    env.update(placeholder_env)
+    env.update(service_env(base_url))
+    env.update(
+        {
+            "CHAINLIT_AUTH_SECRET": secret,
+            "DEBUG_STATS": "true",
+            "PF_CACHE_PATH": "",
+            "IMAGE_STORE_PATH": os.path.join(directory, "images"),
+            "FILE_CACHE_SPILL_PATH": "",
+            "IS_DEV": "false",
+        }
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "chainlit", "run", "app.py", "-h", "--port", str(port)],
+        cwd=app_directory,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    url = "http://127.0.0.1:{}".format(port)
+    try:
+        started = time.monotonic()
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("app exited with code {}".format(process.returncode))
+            try:
+                httpx.get(url + "/debug/stats", timeout=1)
+                break
+            except httpx.TransportError:
+                if time.monotonic() - started > 120:
+                    raise
+                time.sleep(0.1)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def run_levels(url: str, secret: str, args) -> list:
+    print(
+        "{:>8} {:>6} {:>6} {:>6} {:>6} {:>6} {:>6} {:>6} {:>6} {:>10}".format(
+            "sessions", "turns", "errors", "p50", "p95", "p99", "ttft", "lag99",
+            "lagmax", "mem/sess",
+        )
+    )  # fmt: skip
+    levels = []
+    for sessions in args.levels:
+        level = await run_level(url, secret, sessions, args)
+        print_level(level)
+        levels.append(level)
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--levels",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 5, 10, 20],
+        help="comma separated numbers of concurrent sessions",
+    )
+    parser.add_argument("--arrival-rate", type=float, default=5, help="new sessions per second")
+    parser.add_argument("--turns", type=int, default=2, help="turns per session")
+    parser.add_argument("--turn-timeout", type=float, default=120)
+    parser.add_argument("--url", help="load an already running app instead of starting one")
+    parser.add_argument("--secret", default=os.environ.get("CHAINLIT_AUTH_SECRET"))
+    parser.add_argument("--json", help="also write the results to this file")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.url:
+        if not args.secret:
+            parser.error("--secret (the app's CHAINLIT_AUTH_SECRET) is needed with --url")
+        levels = asyncio.run(run_levels(args.url.rstrip("/"), args.secret, args))
+    else:
+        secret = args.secret or uuid.uuid4().hex
+        with running(latency_arguments(args)) as base_url, tempfile.TemporaryDirectory() as directory:
+            with app_server(base_url, secret, free_port(), directory) as url:
+                levels = asyncio.run(run_levels(url, secret, args))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(levels, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
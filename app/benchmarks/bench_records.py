@@ -0,0 +1,83 @@
+"""
+Compare the pandas pipeline get_pf_data_new used to run on every response with the
+record layer in pf_records.
+
+Run from the app directory: `python -m benchmarks.bench_records`
+"""
+import sys
+import json
+import time
+import tracemalloc
+
+import pandas as pd
+
+from pf_records import parse_statistics
+from assistant_tools import story_splitter
+from benchmarks.sample_data import graphql_response
+
+
+def legacy_json_to_dataframe(json_data, address, country):
+    json_data = json.loads(json_data)
+    data = json_data["data"]["getDatasetStatistics"]["datasetStatisticsResponses"]
+    df = pd.DataFrame(data)
+    if not df["info"].apply(lambda x: x == {}).all():
+        info_df = pd.json_normalize(df["info"])
+        df = df.drop(columns=["info"]).join(info_df)
+    df["address"] = address
+    df["country"] = country
+    df = df[["address", "country", "name", "midValue", "unit"]]
+    df = df[df["name"].str.contains("Change")]
+    df = df[~(df["midValue"] == "0.0")]
+    df.reset_index(drop=True, inplace=True)
+    return df
+
+
+def legacy_story_splitter(parsed_output):
+    return (
+        parsed_output[parsed_output.name.str.contains("nights|balance|dry hot")],
+        parsed_output[parsed_output.name.str.contains("annual|wettest|frequency")],
+        parsed_output[parsed_output.name.str.contains("drought|wildfire")],
+    )
+
+
+def legacy_path(response):
+    response = str(response).replace("'", '"')
+    parsed_output = legacy_json_to_dataframe(response, "Miami", "USA")
+    return [chunk.to_json() for chunk in legacy_story_splitter(parsed_output)]
+
+
+def record_path(response):
+    data = response["data"]["getDatasetStatistics"]["datasetStatisticsResponses"]
+    parsed_output = parse_statistics(data, "Miami", "USA")
+    return [chunk.to_json() for chunk in story_splitter(parsed_output)]
+
+
+def measure(function, response, iterations):
+    function(response)  # warm up
+
+    start = time.process_time()
+    for _ in range(iterations):
+        function(response)
+    cpu_per_call = (time.process_time() - start) / iterations
+
+    tracemalloc.start()
+    function(response)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_per_call, peak
+
+
+def main(iterations=500):
+    response = graphql_response()
+    results = {
+        "pandas": measure(legacy_path, response, iterations),
+        "records": measure(record_path, response, iterations),
+    }
+    for name, (cpu_per_call, peak) in results.items():
+        print(f"{name:>8}: {cpu_per_call * 1e6:9.1f} µs CPU/call, {peak / 1024:8.1f} KiB peak alloc")
+    speedup = results["pandas"][0] / results["records"][0]
+    print(f"records path is {speedup:.1f}x faster per call")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
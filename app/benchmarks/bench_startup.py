@@ -0,0 +1,142 @@
+"""
+Measure how fast the app starts: the time to import app.py in a fresh interpreter
+and the time from launching the server until it answers its first HTTP request.
+
+Run from the app directory: `python benchmarks/bench_startup.py`
+
+Against the Docker image, pass the commands to use instead, e.g.
+`python benchmarks/bench_startup.py --python "docker run --rm --env-file .env IMAGE python"
+--command "docker run --rm -p 8080:8080 --env-file .env IMAGE" --url http://127.0.0.1:8080/`
+"""
+import os
+import sys
+import time
+import shlex
+import argparse
+import statistics
+import subprocess
+
+import httpx
+
+app_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Importing app.py only needs these to be set, the benchmark never calls the services
+placeholder_env = {
+    "OPENAI_API_KEY": "sk-benchmark",
+    "OAUTH_AUTH0_CLIENT_ID": "benchmark",
+    "OAUTH_AUTH0_CLIENT_SECRET": "benchmark",
+    "OAUTH_AUTH0_DOMAIN": "benchmark.invalid",
+    "CHAINLIT_AUTH_SECRET": "benchmark",
+}
+
+import_script = (
+    "import time; started = time.perf_counter(); import app; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def benchmark_env():
+    env = dict(os.environ)
+    for name, value in placeholder_env.items():
+        env.setdefault(name, value)
+    return env
+
+
+def import_times(python, repeat):
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            shlex.split(python) + ["-c", import_script],
+            cwd=app_directory,
+            env=benchmark_env(),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def slowest_imports(python, count):
+    """Modules with the largest cumulative import time, from `-X importtime`."""
+    result = subprocess.run(
+        shlex.split(python) + ["-X", "importtime", "-c", "import app"],
+        cwd=app_directory,
+        env=benchmark_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Only modules imported directly by app.py, nested ones are part of them
+        if name.startswith("   ") and not name.startswith("     "):
+            rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def time_to_first_response(command, url, timeout):
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        shlex.split(command),
+        cwd=app_directory,
+        env=benchmark_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError("server exited with code {}".format(process.returncode))
+            try:
+                if httpx.get(url, timeout=1).status_code < 500:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            time.sleep(0.05)
+        raise TimeoutError("no response from {} after {}s".format(url, timeout))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--python", default=sys.executable)
+    parser.add_argument(
+        "--command",
+        default="{} -m chainlit run app.py -h --port 8765".format(sys.executable),
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8765/")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    times = import_times(args.python, args.repeat)
+    print(
+        "import app: median {:.3f}s, min {:.3f}s over {} runs".format(
+            statistics.median(times), min(times), len(times)
+        )
+    )
+    for seconds, name in slowest_imports(args.python, 8):
+        print("  {:>7.3f}s  {}".format(seconds, name))
+
+    times = [
+        time_to_first_response(args.command, args.url, args.timeout)
+        for _ in range(args.repeat)
+    ]
+    print(
+        "time to first response: median {:.3f}s, min {:.3f}s over {} runs".format(
+            statistics.median(times), min(times), len(times)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
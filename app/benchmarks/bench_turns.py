@@ -0,0 +1,193 @@
+"""
+Time conversation turns of the real chat handlers against local fake services.
+
+Starts benchmarks/fake_services.py in a subprocess, points the app at it and
+drives `start_chat` and `run_conversation` for one session. Each turn asks about
+a new location and reports the time to first token (first content shown to the
+user), the full turn latency, the API calls of the turn and the CPU time the app
+spent on it. No network access is needed.
+
+Run from the app directory: `python -m benchmarks.bench_turns`
+"""
+import io
+import os
+import json
+import time
+import logging
+import asyncio
+import argparse
+import tempfile
+import statistics
+import contextlib
+
+from chainlit.emitter import BaseChainlitEmitter
+
+from benchmarks.bench_startup import placeholder_env
+from benchmarks.fake_services import (
+    add_latency_arguments,
+    call_counts,
+    latency_arguments,
+    running,
+    service_env,
+)
+
+locations = [
+    "Miami, United States",
+    "Lagos, Nigeria",
+    "Dhaka, Bangladesh",
+    "Rotterdam, Netherlands",
+    "Phoenix, United States",
+    "Jakarta, Indonesia",
+]
+
+
+class RecordingEmitter(BaseChainlitEmitter):
+    """Emitter that notes when the first content of a turn reaches the UI."""
+
+    def __init__(self, session):
+        super().__init__(session)
+        self.first_content_at = None
+
+    def content_shown(self):
+        if self.first_content_at is None:
+            self.first_content_at = time.perf_counter()
+
+    async def send_message(self, msg_dict: dict):
+        if msg_dict.get("content"):
+            self.content_shown()
+
+    async def update_message(self, msg_dict: dict):
+        if msg_dict.get("content"):
+            self.content_shown()
+
+    async def send_token(self, id: str, token: str, is_sequence=False):
+        if token:
+            self.content_shown()
+
+
+def turn_location(index: int) -> str:
+    # Every turn asks about a new place, so no cache answers it
+    address, country = locations[index % len(locations)].split(", ")
+    if index >= len(locations):
+        address += " " + str(index // len(locations) + 1)
+    return address + ", " + country
+
+
+def isolated_env(base_url: str, directory: str):
+    """Fake services, no caches shared with other runs and no cost report."""
+    os.environ.update(placeholder_env)
+    os.environ.update(service_env(base_url))
+    os.environ.update(
+        {
+            "PF_CACHE_PATH": "",
+            "IMAGE_STORE_PATH": os.path.join(directory, "images"),
+            "FILE_CACHE_SPILL_PATH": "",
+            "IS_DEV": "false",
+        }
+    )
+
+
+async def run_turns(base_url: str, turns: int, verbose: bool):
+    from chainlit.context import init_http_context
+    import chainlit as cl
+    import app
+
+    context = init_http_context()
+    emitter = context.emitter = RecordingEmitter(context.session)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with output:
+        await app.start_chat()
+
+    results = []
+    for index in range(turns):
+        location = turn_location(index)
+        before = await call_counts(base_url)
+        emitter.first_content_at = None
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        with output:
+            await app.run_conversation(cl.Message(content=location))
+        latency = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        after = await call_counts(base_url)
+
+        calls = {
+            label: count - before.get(label, 0)
+            for label, count in sorted(after.items())
+            if count != before.get(label, 0)
+        }
+        results.append(
+            {
+                "location": location,
+                "time_to_first_token": (
+                    emitter.first_content_at - started
+                    if emitter.first_content_at is not None
+                    else None
+                ),
+                "turn_latency": latency,
+                "cpu": cpu,
+                "openai_calls": sum(
+                    count for label, count in calls.items() if not label.startswith("pf.")
+                ),
+                "pf_calls": sum(
+                    count for label, count in calls.items() if label.startswith("pf.")
+                ),
+                "calls": calls,
+            }
+        )
+    return results
+
+
+def print_report(results):
+    print(
+        "{:<28} {:>8} {:>8} {:>8} {:>7} {:>4}".format(
+            "turn", "ttft", "latency", "cpu", "openai", "pf"
+        )
+    )
+    for result in results:
+        print(
+            "{:<28} {:>7.3f}s {:>7.3f}s {:>7.3f}s {:>7} {:>4}".format(
+                result["location"],
+                result["time_to_first_token"] or 0,
+                result["turn_latency"],
+                result["cpu"],
+                result["openai_calls"],
+                result["pf_calls"],
+            )
+        )
+    print(
+        "{:<28} {:>7.3f}s {:>7.3f}s {:>7.3f}s {:>7} {:>4}".format(
+            "median",
+            statistics.median(r["time_to_first_token"] or 0 for r in results),
+            statistics.median(r["turn_latency"] for r in results),
+            statistics.median(r["cpu"] for r in results),
+            statistics.median(r["openai_calls"] for r in results),
+            statistics.median(r["pf_calls"] for r in results),
+        )
+    )
+    print("calls of the last turn:", json.dumps(results[-1]["calls"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the app's output")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with running(latency_arguments(args)) as base_url, tempfile.TemporaryDirectory() as directory:
+        isolated_env(base_url, directory)
+        results = asyncio.run(run_turns(base_url, args.turns, args.verbose))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
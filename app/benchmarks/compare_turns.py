@@ -0,0 +1,95 @@
+"""
+Compare two `bench_turns --json` results, e.g. of the base branch and a pull request.
+
+Prints a Markdown table of the medians, for the job summary, and exits with 1
+when the pull request's median API calls per turn, time to first token or turn
+latency grew beyond the allowed regression. Polling makes the call counts vary
+a little between runs, so they get a small tolerance too.
+
+Run from the app directory:
+`python -m benchmarks.compare_turns base-turn-benchmark.json turn-benchmark.json`
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+
+# (result key, label, unit, is a call count)
+measures = [
+    ("time_to_first_token", "time to first token", "s", False),
+    ("turn_latency", "turn latency", "s", False),
+    ("cpu", "CPU per turn", "s", False),
+    ("openai_calls", "OpenAI calls per turn", "", True),
+    ("pf_calls", "Probable Futures calls per turn", "", True),
+]
+
+
+def medians(results) -> dict:
+    return {
+        key: statistics.median(result[key] or 0 for result in results)
+        for key, _, _, _ in measures
+    }
+
+
+def compare(
+    base: dict, head: dict, max_regression: float, slack: float, max_call_increase: float
+):
+    """The Markdown table rows and the regressions of `head` over `base`."""
+    rows = ["| | base | this change | |", "|---|---:|---:|---|"]
+    regressions = []
+    for key, label, unit, is_count in measures:
+        if is_count:
+            values = "| {} | {:g} | {:g} |".format(label, base[key], head[key])
+            regressed = head[key] > base[key] * (1 + max_call_increase)
+        else:
+            values = "| {} | {:.3f}{} | {:.3f}{} |".format(label, base[key], unit, head[key], unit)
+            # CPU time is too noisy on shared runners to fail a build on
+            regressed = key != "cpu" and head[key] > base[key] * (1 + max_regression) + slack
+        if regressed:
+            regressions.append(label)
+        rows.append(values + (" regression |" if regressed else " |"))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("base", help="results of the base branch")
+    parser.add_argument("head", help="results of the change")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.25,
+        help="allowed relative growth of the median latencies",
+    )
+    parser.add_argument(
+        "--slack", type=float, default=0.1, help="allowed absolute growth in seconds"
+    )
+    parser.add_argument(
+        "--max-call-increase",
+        type=float,
+        default=0.1,
+        help="allowed relative growth of the API calls per turn",
+    )
+    args = parser.parse_args()
+
+    with open(args.head) as f:
+        head = medians(json.load(f))
+    print("### Turn benchmark\n")
+    if not os.path.exists(args.base):
+        print("No results of the base branch to compare with.")
+        return
+    with open(args.base) as f:
+        base = medians(json.load(f))
+
+    rows, regressions = compare(
+        base, head, args.max_regression, args.slack, args.max_call_increase
+    )
+    print("\n".join(rows))
+    if regressions:
+        print("\nRegressed: {}.".format(", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
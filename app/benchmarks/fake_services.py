@@ -0,0 +1,572 @@
+"""
+Local stand-ins for the OpenAI and Probable Futures APIs, for offline benchmarks.
+
+One server answers both:
+- `/v1`: threads, messages, runs and run steps of the Assistants API, chat
+  completions (streamed as canned tokens), image generations and file contents.
+  Every run first calls `get_pf_data_new` for the location in the user's message,
+  then answers with a short message once the tool output is submitted.
+- `/pf`: the token endpoint and a GraphQL endpoint answering the aliased
+  `getDatasetStatistics` mutations, replaying a recorded response.
+- `/_stats`: calls per endpoint, so benchmarks can count the API calls of a turn.
+
+Point the app at it with OPENAI_BASE_URL=http://HOST:PORT/v1,
+PF_API_URL=http://HOST:PORT/pf and PF_TOKEN_URL=http://HOST:PORT/pf/oauth/token.
+
+Run from the app directory: `python -m benchmarks.fake_services --port 8766`
+"""
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import socket
+import asyncio
+import argparse
+import itertools
+import contextlib
+import subprocess
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from benchmarks.sample_data import statistics_responses
+
+app_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+canned_words = (
+    "By the middle of the century summers in the city are longer and hotter , "
+    "nights stay warm , storms bring more rain in less time and dry spells "
+    "stretch further into the year . "
+).split()
+
+# Smallest valid PNG (1x1 transparent pixel), served as the generated image
+tiny_png = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c63f8ffff3f0005fe02fea7d6a4f100"
+    "00000049454e44ae426082"
+)
+
+statistics_mutation = re.compile(
+    r'(\w+): getDatasetStatistics\(input: \{\s*'
+    r'country: ("(?:[^"\\]|\\.)*")\s*'
+    r'address: ("(?:[^"\\]|\\.)*")\s*'
+    r'warmingScenario: ("(?:[^"\\]|\\.)*")'
+)
+
+
+class Latency:
+    """Simulated service times, in seconds."""
+
+    def __init__(
+        self,
+        api: float = 0.02,
+        token: float = 0.005,
+        run: float = 0.3,
+        graphql: float = 0.15,
+        image: float = 0.5,
+        tokens: int = 60,
+    ):
+        self.api = api
+        self.token = token
+        self.run = run
+        self.graphql = graphql
+        self.image = image
+        self.tokens = tokens
+
+
+def page(data: List[dict], params, newest_first: bool) -> dict:
+    """A list response with the `order`, `after` and `limit` handling of the API."""
+    order = params.get("order", "desc" if newest_first else "asc")
+    items = list(reversed(data)) if order == "desc" else list(data)
+    after = params.get("after")
+    if after is not None:
+        ids = [item["id"] for item in items]
+        items = items[ids.index(after) + 1 :] if after in ids else []
+    limit = int(params.get("limit", 20))
+    return {
+        "object": "list",
+        "data": items[:limit],
+        "first_id": items[0]["id"] if items else None,
+        "last_id": items[:limit][-1]["id"] if items else None,
+        "has_more": len(items) > limit,
+    }
+
+
+def split_location(content: str):
+    address, _, country = content.rpartition(",")
+    if not address:
+        return content.strip(), ""
+    return address.strip(), country.strip()
+
+
+class FakeServices:
+    def __init__(self, latency: Latency, recording: Optional[List[dict]] = None):
+        self.latency = latency
+        self.recording = recording
+        self.calls = Counter()  # type: Counter
+        self.ids = itertools.count(1)
+        self.threads = {}  # type: Dict[str, List[dict]]
+        self.runs = {}  # type: Dict[str, dict]
+        self.steps = {}  # type: Dict[str, List[dict]]
+
+    def new_id(self, prefix: str) -> str:
+        # Zero padded so ids sort in creation order like the real ones
+        return "{}_{:08d}".format(prefix, next(self.ids))
+
+    async def answer(self, label: str):
+        self.calls[label] += 1
+        await asyncio.sleep(self.latency.api)
+
+    # Assistants API
+
+    def message(self, thread_id: str, role: str, text: str, run_id=None) -> dict:
+        return {
+            "id": self.new_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "file_ids": [],
+            "assistant_id": "asst_fake" if role == "assistant" else None,
+            "run_id": run_id,
+            "metadata": {},
+        }
+
+    def step(self, run: dict, step_type: str, details: dict, status: str) -> dict:
+        step = {
+            "id": self.new_id("step"),
+            "object": "thread.run.step",
+            "created_at": int(time.time()),
+            "run_id": run["id"],
+            "assistant_id": run["assistant_id"],
+            "thread_id": run["thread_id"],
+            "type": step_type,
+            "status": status,
+            "cancelled_at": None,
+            "completed_at": None,
+            "expired_at": None,
+            "failed_at": None,
+            "last_error": None,
+            "step_details": dict(details, type=step_type),
+            "metadata": {},
+        }
+        self.steps[run["id"]].append(step)
+        return step
+
+    def advance(self, run: dict):
+        """Move a run along its script once its current phase has taken long enough."""
+        if time.monotonic() - run["_phase_started"] < self.latency.run:
+            return
+        if run["_phase"] == "thinking":
+            address, country = split_location(run["_content"])
+            tool_call = {
+                "id": self.new_id("call"),
+                "type": "function",
+                "function": {
+                    "name": "get_pf_data_new",
+                    "arguments": json.dumps({"address": address, "country": country}),
+                    "output": None,
+                },
+            }
+            self.step(run, "tool_calls", {"tool_calls": [tool_call]}, "in_progress")
+            run["status"] = "requires_action"
+            run["required_action"] = {
+                "type": "submit_tool_outputs",
+                "submit_tool_outputs": {"tool_calls": [tool_call]},
+            }
+            run["_phase"] = "waiting"
+        elif run["_phase"] == "answering":
+            message = self.message(
+                run["thread_id"],
+                "assistant",
+                "That is how {} could change. Want to look at another place?".format(
+                    split_location(run["_content"])[0]
+                ),
+                run["id"],
+            )
+            self.threads[run["thread_id"]].append(message)
+            self.step(
+                run,
+                "message_creation",
+                {"message_creation": {"message_id": message["id"]}},
+                "completed",
+            )
+            run["status"] = "completed"
+            run["completed_at"] = int(time.time())
+            run["_phase"] = "done"
+
+    def public(self, run: dict) -> dict:
+        return {key: value for key, value in run.items() if not key.startswith("_")}
+
+    async def create_thread(self, request: Request):
+        await self.answer("threads.create")
+        thread_id = self.new_id("thread")
+        self.threads[thread_id] = []
+        return JSONResponse(
+            {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}}
+        )
+
+    async def create_message(self, request: Request):
+        await self.answer("messages.create")
+        thread_id = request.path_params["thread_id"]
+        body = await request.json()
+        message = self.message(thread_id, body.get("role", "user"), body["content"])
+        self.threads[thread_id].append(message)
+        return JSONResponse(message)
+
+    async def list_messages(self, request: Request):
+        await self.answer("messages.list")
+        messages = self.threads[request.path_params["thread_id"]]
+        return JSONResponse(page(messages, request.query_params, newest_first=True))
+
+    async def retrieve_message(self, request: Request):
+        await self.answer("messages.retrieve")
+        for message in self.threads[request.path_params["thread_id"]]:
+            if message["id"] == request.path_params["message_id"]:
+                return JSONResponse(message)
+        return JSONResponse({"error": {"message": "No message found"}}, status_code=404)
+
+    async def create_run(self, request: Request):
+        await self.answer("runs.create")
+        thread_id = request.path_params["thread_id"]
+        body = await request.json()
+        user_messages = [m for m in self.threads[thread_id] if m["role"] == "user"]
+        run = {
+            "id": self.new_id("run"),
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "assistant_id": body["assistant_id"],
+            "status": "in_progress",
+            "required_action": None,
+            "last_error": None,
+            "expires_at": int(time.time()) + 600,
+            "started_at": int(time.time()),
+            "cancelled_at": None,
+            "failed_at": None,
+            "completed_at": None,
+            "model": "gpt-4-1106-preview",
+            "instructions": "",
+            "tools": [],
+            "file_ids": [],
+            "metadata": {},
+            "_content": user_messages[-1]["content"][0]["text"]["value"],
+            "_phase": "thinking",
+            "_phase_started": time.monotonic(),
+        }
+        self.runs[run["id"]] = run
+        self.steps[run["id"]] = []
+        return JSONResponse(self.public(run))
+
+    async def list_runs(self, request: Request):
+        await self.answer("runs.list")
+        runs = [
+            self.public(run)
+            for run in self.runs.values()
+            if run["thread_id"] == request.path_params["thread_id"]
+        ]
+        return JSONResponse(page(runs, request.query_params, newest_first=True))
+
+    async def retrieve_run(self, request: Request):
+        await self.answer("runs.retrieve")
+        run = self.runs[request.path_params["run_id"]]
+        self.advance(run)
+        return JSONResponse(self.public(run))
+
+    async def submit_tool_outputs(self, request: Request):
+        await self.answer("runs.submit_tool_outputs")
+        run = self.runs[request.path_params["run_id"]]
+        for step in self.steps[run["id"]]:
+            if step["status"] == "in_progress":
+                step["status"] = "completed"
+                step["completed_at"] = int(time.time())
+        run["status"] = "in_progress"
+        run["required_action"] = None
+        run["_phase"] = "answering"
+        run["_phase_started"] = time.monotonic()
+        return JSONResponse(self.public(run))
+
+    async def cancel_run(self, request: Request):
+        await self.answer("runs.cancel")
+        run = self.runs[request.path_params["run_id"]]
+        run["status"] = "cancelled"
+        run["cancelled_at"] = int(time.time())
+        run["_phase"] = "done"
+        return JSONResponse(self.public(run))
+
+    async def list_steps(self, request: Request):
+        await self.answer("runs.steps.list")
+        steps = self.steps[request.path_params["run_id"]]
+        return JSONResponse(page(steps, request.query_params, newest_first=True))
+
+    # Chat completions, images and files
+
+    def canned_tokens(self, prompt: str) -> List[str]:
+        # Vary the start with the prompt so different prompts get different answers
+        start = zlib.crc32(prompt.encode("utf-8")) % len(canned_words)
+        words = itertools.islice(itertools.cycle(canned_words), start, None)
+        return [" " + word for word in itertools.islice(words, self.latency.tokens)]
+
+    async def chat_completions(self, request: Request):
+        body = await request.json()
+        self.calls["chat.completions.create"] += 1
+        await asyncio.sleep(self.latency.api)
+        tokens = self.canned_tokens(json.dumps(body["messages"]))
+        completion_id = self.new_id("chatcmpl")
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.latency.token * len(tokens))
+            return JSONResponse(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "".join(tokens)},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": 100,
+                        "completion_tokens": len(tokens),
+                        "total_tokens": 100 + len(tokens),
+                    },
+                }
+            )
+
+        async def events():
+            for index, token in enumerate(tokens + [None]):
+                if index:
+                    await asyncio.sleep(self.latency.token)
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": token} if token else {},
+                            "finish_reason": None if token else "stop",
+                        }
+                    ],
+                }
+                yield "data: {}\n\n".format(json.dumps(chunk))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def generate_image(self, request: Request):
+        self.calls["images.generate"] += 1
+        await asyncio.sleep(self.latency.image)
+        return JSONResponse(
+            {
+                "created": int(time.time()),
+                "data": [
+                    {
+                        "url": str(request.base_url) + "static/image.png",
+                        "revised_prompt": None,
+                    }
+                ],
+            }
+        )
+
+    async def image(self, request: Request):
+        self.calls["image.download"] += 1
+        return Response(tiny_png, media_type="image/png")
+
+    async def file_content(self, request: Request):
+        await self.answer("files.retrieve_content")
+        return Response(tiny_png, media_type="application/octet-stream")
+
+    # Probable Futures
+
+    async def pf_token(self, request: Request):
+        await self.answer("pf.token")
+        return JSONResponse(
+            {"access_token": "fake-token", "expires_in": 86400, "token_type": "Bearer"}
+        )
+
+    def statistics(self, address: str, warming_scenario: str) -> List[dict]:
+        rows = self.recording or statistics_responses(warming_scenario)
+        # A different place for every address, so the spatial cache sees distinct cells
+        checksum = zlib.crc32(address.encode("utf-8"))
+        latitude = round((checksum % 14000) / 100 - 70, 4)
+        longitude = round(((checksum >> 14) % 36000) / 100 - 180, 4)
+        return [
+            dict(
+                row,
+                warmingScenario=warming_scenario,
+                latitude=latitude,
+                longitude=longitude,
+            )
+            for row in rows
+        ]
+
+    async def graphql(self, request: Request):
+        body = await request.json()
+        self.calls["pf.graphql"] += 1
+        await asyncio.sleep(self.latency.graphql)
+        data = {}
+        for match in statistics_mutation.finditer(body["query"]):
+            alias, _, address, warming_scenario = match.groups()
+            data[alias] = {
+                "datasetStatisticsResponses": self.statistics(
+                    json.loads(address), json.loads(warming_scenario)
+                )
+            }
+        return JSONResponse({"data": data})
+
+    async def stats(self, request: Request):
+        return JSONResponse(dict(self.calls))
+
+    def app(self) -> Starlette:
+        thread = "/v1/threads/{thread_id}"
+        run = thread + "/runs/{run_id}"
+        return Starlette(
+            routes=[
+                Route("/v1/threads", self.create_thread, methods=["POST"]),
+                Route(thread + "/messages", self.create_message, methods=["POST"]),
+                Route(thread + "/messages", self.list_messages, methods=["GET"]),
+                Route(thread + "/messages/{message_id}", self.retrieve_message),
+                Route(thread + "/runs", self.create_run, methods=["POST"]),
+                Route(thread + "/runs", self.list_runs, methods=["GET"]),
+                Route(run, self.retrieve_run),
+                Route(run + "/submit_tool_outputs", self.submit_tool_outputs, methods=["POST"]),
+                Route(run + "/cancel", self.cancel_run, methods=["POST"]),
+                Route(run + "/steps", self.list_steps),
+                Route("/v1/chat/completions", self.chat_completions, methods=["POST"]),
+                Route("/v1/images/generations", self.generate_image, methods=["POST"]),
+                Route("/v1/files/{file_id}/content", self.file_content),
+                Route("/static/image.png", self.image),
+                Route("/pf/oauth/token", self.pf_token, methods=["POST"]),
+                Route("/pf/graphql", self.graphql, methods=["POST"]),
+                Route("/_stats", self.stats),
+            ]
+        )
+
+
+def service_env(base_url: str) -> Dict[str, str]:
+    """Environment variables that point the app at the fake services."""
+    return {
+        "OPENAI_BASE_URL": base_url + "/v1",
+        "OPENAI_API_KEY": "sk-fake",
+        "ASSISTANT_ID": "asst_fake",
+        "MODEL": "gpt-4-1106-preview",
+        "PF_API_URL": base_url + "/pf",
+        "PF_TOKEN_URL": base_url + "/pf/oauth/token",
+        "CLIENT_ID": "fake",
+        "CLIENT_SECRET": "fake",
+    }
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser):
+    defaults = Latency()
+    parser.add_argument("--api-latency", type=float, default=defaults.api)
+    parser.add_argument("--token-latency", type=float, default=defaults.token)
+    parser.add_argument("--run-latency", type=float, default=defaults.run)
+    parser.add_argument("--graphql-latency", type=float, default=defaults.graphql)
+    parser.add_argument("--image-latency", type=float, default=defaults.image)
+    parser.add_argument("--completion-tokens", type=int, default=defaults.tokens)
+    parser.add_argument(
+        "--recording",
+        help="JSON file with recorded datasetStatisticsResponses to replay",
+    )
+
+
+def latency_arguments(args) -> List[str]:
+    """The latency options of `args` as command line arguments for the server."""
+    arguments = [
+        "--api-latency", str(args.api_latency),
+        "--token-latency", str(args.token_latency),
+        "--run-latency", str(args.run_latency),
+        "--graphql-latency", str(args.graphql_latency),
+        "--image-latency", str(args.image_latency),
+        "--completion-tokens", str(args.completion_tokens),
+    ]  # fmt: skip
+    if args.recording:
+        arguments += ["--recording", args.recording]
+    return arguments
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def running(arguments: List[str] = (), port: Optional[int] = None):
+    """Run the fake services in a subprocess and yield their base URL."""
+    port = port or free_port()
+    base_url = "http://127.0.0.1:{}".format(port)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_services", "--port", str(port)]
+        + list(arguments),
+        cwd=app_directory,
+    )
+    try:
+        started = time.monotonic()
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("fake services exited with code {}".format(process.returncode))
+            try:
+                httpx.get(base_url + "/_stats", timeout=1)
+                break
+            except httpx.TransportError:
+                if time.monotonic() - started > 30:
+                    raise
+                time.sleep(0.05)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def call_counts(base_url: str) -> Dict[str, int]:
+    async with httpx.AsyncClient() as http_client:
+        response = await http_client.get(base_url + "/_stats")
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    recording = None
+    if args.recording:
+        with open(args.recording) as f:
+            recording = json.load(f)
+    latency = Latency(
+        api=args.api_latency,
+        token=args.token_latency,
+        run=args.run_latency,
+        graphql=args.graphql_latency,
+        image=args.image_latency,
+        tokens=args.completion_tokens,
+    )
+    uvicorn.run(
+        FakeServices(latency, recording).app(),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Representative getDatasetStatistics payload used by the offline benchmarks
+
+dataset_names = [
+    ("Average temperature", "°C"),
+    ("Average daytime temperature", "°C"),
+    ("10 hottest days", "°C"),
+    ("Days above 32°C (90°F)", "days"),
+    ("Days above 35°C (95°F)", "days"),
+    ("Days above 38°C (100°F)", "days"),
+    ("Average nighttime temperature", "°C"),
+    ("Frost nights", "nights"),
+    ("Nights above 20°C (68°F)", "nights"),
+    ("Nights above 25°C (77°F)", "nights"),
+    ("Days above 26°C wet-bulb", "days"),
+    ("Days above 28°C wet-bulb", "days"),
+    ("Days above 30°C wet-bulb", "days"),
+    ("Days above 32°C wet-bulb", "days"),
+    ("10 hottest wet-bulb days", "°C"),
+    ("Change in total annual precipitation", "mm"),
+    ("Change in wettest 90 days", "mm"),
+    ("Change in dry hot days", "days"),
+    ("Change in frequency of 1-in-100-year storm", "x as frequent"),
+    ("Change in precipitation 1-in-100-year storm", "mm"),
+    ("Change in snowy days", "days"),
+    ("Change in water balance", "z-score"),
+    ("Likelihood of year-plus extreme drought", "%"),
+    ("Likelihood of year-plus drought", "%"),
+    ("Change in wildfire danger days", "days"),
+    ("Change in frequency of 1-in-100-year drought", "x as frequent"),
+    ("Change in nights above 25°C", "nights"),
+    ("Change in days above 35°C", "days"),
+]
+
+
+catalog_ids = {
+    "Average temperature": 40101,
+    "Average daytime temperature": 40102,
+    "10 hottest days": 40103,
+    "Days above 32°C (90°F)": 40104,
+    "Days above 35°C (95°F)": 40105,
+    "Days above 38°C (100°F)": 40106,
+    "Average nighttime temperature": 40201,
+    "Frost nights": 40202,
+    "Nights above 20°C (68°F)": 40203,
+    "Nights above 25°C (77°F)": 40204,
+    "Days above 26°C wet-bulb": 40301,
+    "Days above 28°C wet-bulb": 40302,
+    "Days above 30°C wet-bulb": 40303,
+    "Days above 32°C wet-bulb": 40304,
+    "10 hottest wet-bulb days": 40305,
+    "Change in total annual precipitation": 40601,
+    "Change in dry hot days": 40607,
+    "Change in wettest 90 days": 40612,
+    "Change in frequency of 1-in-100-year storm": 40613,
+    "Change in precipitation 1-in-100-year storm": 40614,
+    "Change in snowy days": 40616,
+    "Likelihood of year-plus extreme drought": 40701,
+    "Likelihood of year-plus drought": 40702,
+    "Change in wildfire danger days": 40703,
+    "Change in water balance": 40704,
+}
+
+
+def statistics_responses(warming_scenario="2.0"):
+    return [
+        {
+            # Datasets of the catalog, plus a few it does not know yet
+            "datasetId": catalog_ids.get(name, 49000 + index),
+            "midValue": "0.0" if index % 9 == 0 else f"{index * 1.7:.1f}",
+            "name": name,
+            "unit": unit,
+            "warmingScenario": warming_scenario,
+            "latitude": 25.77,
+            "longitude": -80.19,
+            "info": {},
+        }
+        for index, (name, unit) in enumerate(dataset_names)
+    ]
+
+
+def graphql_response(warming_scenario="2.0"):
+    return {
+        "data": {
+            "getDatasetStatistics": {
+                "datasetStatisticsResponses": statistics_responses(warming_scenario)
+            }
+        }
+    }
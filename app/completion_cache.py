@@ -0,0 +1,102 @@
+import os
+import hashlib
+import asyncio
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+
+def file_version(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+# Any edit to prompts.py changes every key, so completions for old prompts stop
+# matching and age out of the cache
+prompts_version = file_version(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts.py")
+)
+
+
+def completion_key(model: str, system_prompt: str, content: str) -> str:
+    digest = hashlib.sha256()
+    for part in (prompts_version, model, system_prompt, content):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CompletionCache:
+    """
+    Content-addressed cache of chat completions, bounded by the number of
+    characters stored and evicted least recently used first.
+
+    Streams are recorded token by token while they are forwarded, and stored only
+    once they finish. A hit is replayed through the same async iterator at
+    `replay_rate` tokens per second, so the UI streams it like a live answer.
+    """
+
+    def __init__(self, max_chars: int, replay_rate: float):
+        self.max_chars = max_chars
+        self.replay_rate = replay_rate
+        self.entries = OrderedDict()  # type: OrderedDict[str, Tuple[str, ...]]
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, ...]]:
+        tokens = self.entries.get(key)
+        if tokens is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return tokens
+
+    def set(self, key: str, tokens: Tuple[str, ...]):
+        size = sum(len(token) for token in tokens)
+        if size > self.max_chars:
+            return
+        if key in self.entries:
+            self.size -= sum(len(token) for token in self.entries.pop(key))
+        self.entries[key] = tokens
+        self.size += size
+        while self.size > self.max_chars:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= sum(len(token) for token in evicted)
+
+    async def replay(self, tokens: Tuple[str, ...]) -> AsyncIterator[str]:
+        delay = 1 / self.replay_rate if self.replay_rate > 0 else 0
+        for token in tokens:
+            yield token
+            await asyncio.sleep(delay)
+
+    async def stream(
+        self, key: str, create_stream: Callable[[], Awaitable]
+    ) -> AsyncIterator[str]:
+        """Yield the text tokens of a streamed chat completion, cached by `key`."""
+        tokens = self.get(key)
+        if tokens is not None:
+            async for token in self.replay(tokens):
+                yield token
+            return
+
+        recorded = []
+        async for part in await create_stream():
+            if token := part.choices[0].delta.content or "":
+                recorded.append(token)
+                yield token
+        self.set(key, tuple(recorded))
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "chars": self.size,
+        }
+
+
+completion_cache = CompletionCache(
+    max_chars=int(os.environ.get("COMPLETION_CACHE_MAX_CHARS", str(8 * 1024 * 1024))),
+    replay_rate=float(os.environ.get("COMPLETION_REPLAY_RATE", "200")),
+)
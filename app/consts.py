@@ -5,3 +5,25 @@ note_message = "The accurate cost of the assistant is unpredictable, especially
 assistant_id = os.environ.get("ASSISTANT_ID")
 assistant_model = os.environ.get("MODEL")
 is_dev = os.environ.get("IS_DEV") == "true"
+
+# How many story chunks (story, summarizer and image) are generated at the same time
+story_concurrency = int(os.environ.get("STORY_CONCURRENCY", "3"))
+
+# Warming scenarios (in °C) offered by the Probable Futures API
+warming_scenarios = ["1.0", "1.5", "2.0", "2.5", "3.0"]
+
+# Fetch every warming scenario of a location in one request and cache them
+prefetch_scenarios = os.environ.get("PF_PREFETCH_SCENARIOS", "true") == "true"
+
+# Start fetching the data of the places a user's message names before the assistant asks
+prefetch_locations = os.environ.get("PF_PREFETCH_LOCATIONS", "true") == "true"
+
+# Serve process statistics (event loop lag, memory, caches) on /debug/stats
+debug_stats = os.environ.get("DEBUG_STATS") == "true"
+
+# Print the API calls, UI updates and stage timings of every turn
+turn_reports = os.environ.get("TURN_REPORTS", "true" if is_dev else "false") == "true"
+
+# Serve Prometheus metrics (stage latencies, time to first token, caches) on /metrics.
+# Unauthenticated like /debug/stats, so off unless the port is only reachable internally.
+metrics_endpoint = os.environ.get("METRICS_ENDPOINT") == "true"
@@ -6,6 +6,8 @@ import asyncio
 from dotenv import load_dotenv
 import sys
 
+import consts
+
 load_dotenv()
 
 api_key = os.environ.get("OPENAI_API_KEY")
@@ -29,7 +31,7 @@ async def create():
                 },
                 "warming_scenario": {
                     "type": "string",
-                    "enum": ["1.0", "1.5", "2.0", "2.5", "3.0"],
+                    "enum": consts.warming_scenarios,
                     "description": ("The warming scenario to get data for. Default is 1.5"),
                 }
 
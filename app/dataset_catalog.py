@@ -0,0 +1,113 @@
+import os
+import re
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# The story is told in three chunks, in this order
+story_categories = ("temperature", "water", "land")
+
+# Fallback for datasets missing from dataset_catalog.json: names containing one of
+# these belong to the chunk. A dataset can belong to more than one chunk, as it did
+# with the previous regex filters.
+category_keywords = {
+    "temperature": ("nights", "balance", "dry hot"),
+    "water": ("annual", "wettest", "frequency"),
+    "land": ("drought", "wildfire"),
+}
+
+
+class CatalogEntry:
+    __slots__ = ("dataset_id", "name", "categories", "unit", "display_name", "is_change")
+
+    def __init__(self, dataset_id, name, categories, unit, display_name, is_change):
+        self.dataset_id = dataset_id
+        # The name the API gives the dataset, to notice a catalog that is out of date
+        self.name = name
+        self.categories = categories  # type: Tuple[str, ...]
+        self.unit = unit
+        self.display_name = display_name
+        self.is_change = is_change
+
+
+def classify(name: str) -> Tuple[str, ...]:
+    return tuple(
+        category
+        for category in story_categories
+        if any(keyword in name for keyword in category_keywords[category])
+    )
+
+
+def same_name(a: str, b: str) -> bool:
+    # The API has changed quotes and spacing of names before
+    return re.sub(r"[^\w%]+", "", a).lower() == re.sub(r"[^\w%]+", "", b).lower()
+
+
+class DatasetCatalog:
+    """
+    Story category, unit and display name of every Probable Futures dataset, keyed
+    by datasetId.
+
+    The known datasets are loaded from dataset_catalog.json at startup, so
+    splitting a response is one dictionary lookup per row. A new dataset is placed
+    in a chunk by adding it to the file, e.g.
+    `"40616": {"name": "Change in snowy days", "unit": "days", "categories": ["water"],
+    "is_change": true}`, with an optional "display_name". Datasets missing from the
+    file, or whose name no longer matches it, are classified from their name with
+    `category_keywords` the first time they are seen.
+    """
+
+    def __init__(self):
+        self.entries = {}  # type: Dict[int, CatalogEntry]
+
+    def load(self, path: Optional[str]):
+        if not path or not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            known = json.load(f)
+        self.entries = {
+            int(dataset_id): CatalogEntry(
+                int(dataset_id),
+                dataset["name"],
+                tuple(dataset["categories"]),
+                dataset["unit"],
+                dataset.get("display_name", dataset["name"]),
+                dataset["is_change"],
+            )
+            for dataset_id, dataset in known.items()
+        }
+
+    def entry(self, dataset_id, name: str, unit: str) -> CatalogEntry:
+        entry = self.entries.get(dataset_id)
+        if entry is not None and (entry.name == name or same_name(entry.name, name)):
+            return entry
+        if entry is not None:
+            print(
+                "Dataset {} is now named {!r}, not {!r}; classifying it by name".format(
+                    dataset_id, name, entry.name
+                )
+            )
+        entry = CatalogEntry(dataset_id, name, classify(name), unit, name, "Change" in name)
+        # Rows without an id are classified every time
+        if dataset_id is not None:
+            self.entries[dataset_id] = entry
+        return entry
+
+    def split(self, rows: Iterable) -> Dict[str, List]:
+        """Group rows with a `dataset_id` by story category in a single pass."""
+        groups = {category: [] for category in story_categories}
+        for row in rows:
+            entry = self.entries.get(row.dataset_id)
+            if entry is None:
+                entry = self.entry(row.dataset_id, row.name, row.unit)
+            for category in entry.categories:
+                groups[category].append(row)
+        return groups
+
+
+dataset_catalog = DatasetCatalog()
+dataset_catalog.load(
+    os.environ.get(
+        "PF_DATASET_CATALOG",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset_catalog.json"),
+    )
+)
@@ -0,0 +1,82 @@
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+
+class FileCache:
+    """
+    Process-wide cache of OpenAI file contents (e.g. code interpreter charts) keyed
+    by file id, so each file is downloaded at most once.
+
+    Contents are kept in memory up to `max_bytes`, least recently used first out.
+    With a `spill_directory`, evicted files are written there and read back from
+    disk instead of being downloaded again.
+    """
+
+    def __init__(self, max_bytes: int, spill_directory: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.spill_directory = spill_directory
+        self.memory = OrderedDict()  # type: OrderedDict[str, bytes]
+        self.size = 0
+        self.hits = 0
+        self.downloads = 0
+
+    def spill_path(self, file_id: str) -> str:
+        return os.path.join(self.spill_directory, os.path.basename(file_id))
+
+    def get(self, file_id: str) -> Optional[bytes]:
+        content = self.memory.get(file_id)
+        if content is not None:
+            self.memory.move_to_end(file_id)
+            return content
+        if self.spill_directory and os.path.exists(self.spill_path(file_id)):
+            with open(self.spill_path(file_id), "rb") as f:
+                content = f.read()
+            self.set(file_id, content)
+            return content
+        return None
+
+    def set(self, file_id: str, content: bytes):
+        if file_id in self.memory:
+            self.size -= len(self.memory.pop(file_id))
+        self.memory[file_id] = content
+        self.size += len(content)
+        while self.size > self.max_bytes and self.memory:
+            evicted_id, evicted = self.memory.popitem(last=False)
+            self.size -= len(evicted)
+            self.spill(evicted_id, evicted)
+
+    def spill(self, file_id: str, content: bytes):
+        if not self.spill_directory or os.path.exists(self.spill_path(file_id)):
+            return
+        os.makedirs(self.spill_directory, exist_ok=True)
+        temporary_path = self.spill_path(file_id) + ".part"
+        with open(temporary_path, "wb") as f:
+            f.write(content)
+        os.replace(temporary_path, self.spill_path(file_id))
+
+    async def get_or_fetch(
+        self, file_id: str, fetch: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        content = self.get(file_id)
+        if content is not None:
+            self.hits += 1
+            return content
+        content = await fetch()
+        self.downloads += 1
+        self.set(file_id, content)
+        return content
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "downloads": self.downloads,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.size,
+        }
+
+
+file_cache = FileCache(
+    max_bytes=int(os.environ.get("FILE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    spill_directory=os.environ.get("FILE_CACHE_SPILL_PATH", ".cache/files") or None,
+)
@@ -0,0 +1,104 @@
+import os
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+import tracing
+
+
+def image_key(storyboard_prompt: str, prompt: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(storyboard_prompt.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ImageStore:
+    """
+    Content-addressed store for generated images on local disk.
+
+    DALL-E returns a URL that expires, so every image is downloaded once and kept
+    under the hash of the prompt it was generated from. A repeated prompt is served
+    from disk without generating again, and messages that point at the file keep
+    working after the URL has expired. Concurrent requests for the same prompt share
+    one generation. Downloads share one HTTP client, as building one per image
+    costs an SSL context on the event loop.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+        self.generated = 0
+        self._pending = {}  # type: Dict[str, asyncio.Task]
+        self._client = None  # type: Optional[httpx.AsyncClient]
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=60)
+        return self._client
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".png")
+
+    async def get_or_generate(
+        self, key: str, generate_url: Callable[[], Awaitable[str]]
+    ) -> Tuple[str, bool]:
+        """
+        Return the local path of the image, generating it on a miss, and whether
+        this call generated it.
+        """
+        path = self.path(key)
+        while True:
+            if os.path.exists(path):
+                self.hits += 1
+                return path, False
+            task = self._pending.get(key)
+            if task is None:
+                break
+            try:
+                # Shielded: a waiter that is stopped leaves the generation alone
+                await asyncio.shield(task)
+            except Exception:
+                # Another session's generation failed, the loop tries on our own
+                continue
+            self.hits += 1
+            return path, False
+
+        # The generation runs in its own task, so stopping the session that
+        # started it does not cancel it for the sessions waiting on it
+        task = asyncio.create_task(self._generate(key, path, generate_url))
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self._pending[key] = task
+        return await asyncio.shield(task), True
+
+    async def _generate(
+        self, key: str, path: str, generate_url: Callable[[], Awaitable[str]]
+    ) -> str:
+        try:
+            url = await generate_url()
+            await self.download(url, path)
+            self.generated += 1
+            return path
+        finally:
+            del self._pending[key]
+
+    async def download(self, url: str, path: str):
+        with tracing.span("image_download"):
+            response = await self.client.get(url)
+            response.raise_for_status()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a partial image
+        temporary_path = path + ".part"
+        with open(temporary_path, "wb") as f:
+            f.write(response.content)
+        os.replace(temporary_path, path)
+
+    def stats(self):
+        return {"hits": self.hits, "generated": self.generated}
+
+
+image_store = ImageStore(os.environ.get("IMAGE_STORE_PATH", ".cache/images"))
@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import tracing
+from pf_cache import location_key
+
+
+def words(text: str) -> Tuple[str, ...]:
+    return tuple(re.findall(r"[^\W_]+", str(text).lower()))
+
+
+class Place:
+    __slots__ = ("address", "country", "latitude", "longitude")
+
+    def __init__(self, address: str, country: str, latitude: float, longitude: float):
+        self.address = address
+        self.country = country
+        self.latitude = latitude
+        self.longitude = longitude
+
+    @property
+    def key(self) -> str:
+        return location_key(self.address, self.country)
+
+
+class Gazetteer:
+    """
+    Bundled city and country names, to recognize the places a message names
+    without calling any service, with the coordinate of every city.
+
+    Names are matched as whole words, longest first, so "Mexico City" wins over
+    "Mexico". When the message names a country, or a region of one such as a US
+    state, only places in that country are matched: "Paris, Texas" is not Paris,
+    France.
+    """
+
+    def __init__(self):
+        self.places = {}  # type: Dict[Tuple[str, ...], List[Place]]
+        self.countries = {}  # type: Dict[Tuple[str, ...], str]
+        self.longest = 0
+
+    def load(self, path: Optional[str]):
+        if not path or not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for country, aliases in data["countries"].items():
+            for name in [country] + aliases:
+                self.countries[words(name)] = country
+        for country, regions in data.get("regions", {}).items():
+            for name in regions:
+                self.countries.setdefault(words(name), country)
+        for entry in data["places"]:
+            place = Place(*entry[:4])
+            for name in [entry[0]] + (entry[4] if len(entry) > 4 else []):
+                self.places.setdefault(words(name), []).append(place)
+        self.longest = max(len(name) for name in list(self.places) + list(self.countries))
+
+    def find(self, text: str, limit: int = 3) -> List[Place]:
+        """The places `text` names, in order, at most `limit`."""
+        tokens = words(text)
+        matches = []  # type: List[List[Place]]
+        countries = set()
+        index = 0
+        place_end = -1
+        while index < len(tokens):
+            for length in range(min(self.longest, len(tokens) - index), 0, -1):
+                name = tokens[index : index + length]
+                if name in self.places or name in self.countries:
+                    # Right after a place, "Washington" is its state, not the city
+                    qualifies = name in self.countries and index == place_end
+                    if name in self.places and not qualifies:
+                        matches.append(self.places[name])
+                        place_end = index + length
+                    if name in self.countries:
+                        countries.add(self.countries[name])
+                    index += length
+                    break
+            else:
+                index += 1
+
+        places = []  # type: List[Place]
+        for candidates in matches:
+            if countries:
+                candidates = [place for place in candidates if place.country in countries]
+            if candidates and candidates[0].key not in [place.key for place in places]:
+                places.append(candidates[0])
+        return places[:limit]
+
+    def lookup(self, address, country) -> Optional[Place]:
+        """The place named exactly by an address and country, e.g. the tool's arguments."""
+        country = self.countries.get(words(country))
+        for place in self.places.get(words(address), ()):
+            if place.country == country:
+                return place
+        return None
+
+
+class Prefetch:
+    __slots__ = ("started_at", "task", "claims")
+
+    def __init__(self, task: asyncio.Task):
+        self.started_at = time.monotonic()
+        self.task = task
+        self.claims = 0
+
+
+class LocationPrefetcher:
+    """
+    Starts the Probable Futures query for the places a user's message names, while
+    the assistant run is still deciding to call `get_pf_data_new`.
+
+    The prefetch goes through `fetch`, the tool's own path (token, GraphQL,
+    caches). A tool call for a place the gazetteer knows as a prefetched one waits
+    for that prefetch instead of sending its own query. Prefetches that no tool
+    call claimed within `max_age` seconds count as wasted.
+    """
+
+    def __init__(
+        self,
+        gazetteer: Gazetteer,
+        fetch: Callable[[str, str], Awaitable],
+        max_age: float = 300,
+        limit: int = 3,
+    ):
+        self.gazetteer = gazetteer
+        self.fetch = fetch
+        self.max_age = max_age
+        self.limit = limit
+        self.pending = OrderedDict()  # type: OrderedDict[str, Prefetch]
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+        self.failed = 0
+
+    def prefetch(self, text: str) -> List[Place]:
+        self._expire()
+        places = self.gazetteer.find(text, self.limit)
+        for place in places:
+            if place.key not in self.pending:
+                self.started += 1
+                self.pending[place.key] = Prefetch(asyncio.create_task(self._fetch(place)))
+        return places
+
+    async def _fetch(self, place: Place) -> bool:
+        try:
+            with tracing.span("pf_prefetch"):
+                await self.fetch(place.address, place.country)
+            return True
+        except Exception as e:
+            # The tool call sends its own query
+            print("Prefetch of {}, {} failed: {!r}".format(place.address, place.country, e))
+            self.failed += 1
+            self.pending.pop(place.key, None)
+            return False
+
+    async def claim(self, address, country) -> Optional[Place]:
+        """
+        Wait for the prefetch of the place a tool call asks for. Returns the place,
+        whose data is then cached under its gazetteer spelling, or None.
+        """
+        self._expire()
+        place = self.gazetteer.lookup(address, country)
+        prefetch = self.pending.get(place.key) if place is not None else None
+        # Cancelling the tool call leaves the prefetch to the other sessions
+        if prefetch is None or not await asyncio.shield(prefetch.task):
+            self.misses += 1
+            return None
+        prefetch.claims += 1
+        self.hits += 1
+        return place
+
+    def _expire(self):
+        now = time.monotonic()
+        while self.pending:
+            key, prefetch = next(iter(self.pending.items()))
+            if now - prefetch.started_at < self.max_age:
+                break
+            del self.pending[key]
+            if not prefetch.claims:
+                self.wasted += 1
+
+    def stats(self):
+        self._expire()
+        claimed = self.hits + self.misses
+        return {
+            "started": self.started,
+            "pending": len(self.pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / claimed if claimed else 0.0,
+            "wasted": self.wasted,
+            "failed": self.failed,
+        }
+
+
+gazetteer = Gazetteer()
+gazetteer.load(
+    os.environ.get(
+        "PF_GAZETTEER",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.json"),
+    )
+)
+
+
+def create_location_prefetcher(fetch: Callable[[str, str], Awaitable]) -> LocationPrefetcher:
+    return LocationPrefetcher(
+        gazetteer,
+        fetch,
+        max_age=float(os.environ.get("PF_PREFETCH_MAX_AGE", "300")),
+    )
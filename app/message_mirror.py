@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import List, Optional, Set
+
+from openai import AsyncOpenAI
+from openai.types.beta.threads import ThreadMessage
+
+from pagination import list_after
+
+
+class MessageMirror:
+    """
+    Local copy of a thread's messages, oldest first, kept for the whole session.
+    The UI renders the assistant's messages from it and the cost report reads it.
+
+    A message is settled once it can no longer change: the session created it, or
+    its run step has finished. `sync` only asks for the messages after the leading
+    settled ones, using the `after` cursor of `messages.list`, so the messages
+    still being written and the new ones come back in one call. The calls and
+    payload of a turn therefore stay the same however long the conversation gets.
+    """
+
+    def __init__(self, client: AsyncOpenAI, thread_id: str):
+        self.client = client
+        self.thread_id = thread_id
+        self.messages = OrderedDict()  # type: OrderedDict[str, ThreadMessage]
+        self.settled = set()  # type: Set[str]
+        self.api_calls = 0
+        self.fetched_messages = 0
+        self.fetched_bytes = 0
+
+    def upsert(self, message: ThreadMessage, settled: bool = False):
+        """Store a new message, or refresh the content of a known one in place."""
+        self.messages[message.id] = message
+        if settled:
+            self.settled.add(message.id)
+
+    def settle(self, message_id: str):
+        self.settled.add(message_id)
+
+    def cursor(self) -> Optional[str]:
+        """The newest message before the first one that may still change."""
+        after = None
+        for message_id in self.messages:
+            if message_id not in self.settled:
+                break
+            after = message_id
+        return after
+
+    async def _list_messages(self, **params):
+        self.api_calls += 1
+        return await self.client.beta.threads.messages.list(
+            thread_id=self.thread_id, **params
+        )
+
+    async def sync(self, settled: bool = False):
+        """
+        Fetch the messages that may have changed or are new. With `settled`, e.g.
+        once the run is over, they are all final.
+        """
+        for message in await list_after(self._list_messages, self.cursor()):
+            self.fetched_messages += 1
+            self.fetched_bytes += len(message.model_dump_json())
+            self.upsert(message, settled)
+
+    def newest_first(self) -> List[ThreadMessage]:
+        """Messages in the order `messages.list` returns them by default."""
+        return list(reversed(self.messages.values()))
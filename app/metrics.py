@@ -0,0 +1,145 @@
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Seconds, from a cache hit to a full story turn
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = ['{}="{}"'.format(name, escape(str(value))) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}  # type: Dict[Tuple[str, ...], float]
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} counter".format(self.name)]
+        for key, value in sorted(self.values.items()):
+            lines.append("{}{} {}".format(self.name, format_labels(self.label_names, key), value))
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = default_buckets,
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., sum, count]
+        self.values = {}  # type: Dict[Tuple[str, ...], List[float]]
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} histogram".format(self.name)]
+        for key, series in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, series):
+                labels = format_labels(self.label_names, key, 'le="{}"'.format(bound))
+                lines.append("{}_bucket{} {}".format(self.name, labels, count))
+            labels = format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append("{}_bucket{} {}".format(self.name, labels, series[-1]))
+            labels = format_labels(self.label_names, key)
+            lines.append("{}_sum{} {}".format(self.name, labels, series[-2]))
+            lines.append("{}_count{} {}".format(self.name, labels, series[-1]))
+        return lines
+
+
+def flatten(stats: dict, prefix: str) -> List[Tuple[str, float]]:
+    values = []
+    for key, value in stats.items():
+        name = prefix + "_" + str(key).replace(".", "_").replace("-", "_")
+        if isinstance(value, dict):
+            values.extend(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values.append((name, value))
+    return values
+
+
+class Registry:
+    """
+    Metrics of the process in the Prometheus text format.
+
+    Besides its own counters and histograms it exposes the `stats()` of the
+    caches and clients as gauges, read when the metrics are scraped.
+    """
+
+    def __init__(self, prefix: str = "app"):
+        self.prefix = prefix
+        self.metrics = []  # type: List
+        self.collectors = []  # type: List[Tuple[str, Callable[[], dict]]]
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(self.prefix + "_" + name, help, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str] = ()) -> Histogram:
+        metric = Histogram(self.prefix + "_" + name, help, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self, name: str, stats: Callable[[], dict]):
+        self.collectors.append((self.prefix + "_" + name, stats))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, stats in self.collectors:
+            for name, value in flatten(stats(), prefix):
+                lines.append("# TYPE {} gauge".format(name))
+                lines.append("{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "stage_seconds", "Duration of each stage of a turn", ["stage"]
+)
+turn_seconds = registry.histogram(
+    "turn_seconds", "Time from the user's message until the run ended"
+)
+time_to_first_token_seconds = registry.histogram(
+    "time_to_first_token_seconds",
+    "Time from the user's message until the first answer content reached the UI",
+)
+turns_total = registry.counter("turns_total", "Turns by final run status", ["status"])
+ui_updates_total = registry.counter(
+    "ui_updates_total", "Message updates sent to the UI, or suppressed, by kind", ["kind"]
+)
+run_api_calls_total = registry.counter(
+    "run_api_calls_total", "Assistants API calls made to follow runs"
+)
+run_api_calls_saved_total = registry.counter(
+    "run_api_calls_saved_total", "Assistants API calls saved compared to polling every step"
+)
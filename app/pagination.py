@@ -0,0 +1,24 @@
+from typing import Any, Awaitable, Callable, List, Optional
+
+
+async def list_after(
+    list_page: Callable[..., Awaitable[Any]], after: Optional[str] = None
+) -> List[Any]:
+    """
+    Every item of an assistants list endpoint that comes after the `after` id,
+    oldest first. `list_page(**params)` fetches one page.
+    """
+    params = {"order": "asc", "limit": 100}
+    if after is not None:
+        params["after"] = after
+
+    items = []  # type: List[Any]
+    while True:
+        page = await list_page(**params)
+        items.extend(page.data)
+        # The 1.3.5 paginator ignores `has_more` and would always ask for one
+        # more (empty) page, so follow the flag from the response ourselves.
+        if not page.data or not getattr(page, "has_more", False):
+            break
+        params["after"] = page.data[-1].id
+    return items
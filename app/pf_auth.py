@@ -0,0 +1,77 @@
+import os
+import time
+import asyncio
+from typing import Optional
+
+from pf_client import pf_http
+import tracing
+
+
+class TokenManager:
+    """
+    Process-wide cache for the Probable Futures access token.
+
+    The token is reused until `refresh_margin` seconds before its `expires_in`.
+    When many requests find it stale at the same time only one of them asks the
+    auth server for a new token, the others wait for it and reuse the result.
+    """
+
+    def __init__(self, refresh_margin: float = 60):
+        self.refresh_margin = refresh_margin
+        self.access_token = None  # type: Optional[str]
+        self.expires_at = 0.0
+        self.hits = 0
+        self.refreshes = 0
+        # Concurrent callers of an expired token wait for one refresh
+        self._lock = None  # type: Optional[asyncio.Lock]
+
+    def is_fresh(self) -> bool:
+        return (
+            self.access_token is not None
+            and time.monotonic() < self.expires_at - self.refresh_margin
+        )
+
+    async def get_token(self) -> str:
+        if self.is_fresh():
+            self.hits += 1
+            return self.access_token
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another request may have refreshed the token while we waited
+            if self.is_fresh():
+                self.hits += 1
+            else:
+                await self.refresh()
+            return self.access_token
+
+    async def refresh(self):
+        with tracing.span("pf_token"):
+            response = await pf_http.post(
+                os.getenv("PF_TOKEN_URL"),
+                label="token",
+                json={
+                    "client_id": os.getenv("CLIENT_ID"),
+                    "client_secret": os.getenv("CLIENT_SECRET"),
+                    "audience": os.getenv("PF_TOKEN_AUDIENCE"),
+                    "grant_type": "client_credentials",
+                },
+            )
+        token = response.json()
+        self.access_token = token["access_token"]
+        self.expires_at = time.monotonic() + float(token.get("expires_in", 0))
+        self.refreshes += 1
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after the API rejected it."""
+        self.access_token = None
+        self.expires_at = 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "refreshes": self.refreshes}
+
+
+token_manager = TokenManager(
+    refresh_margin=float(os.environ.get("PF_TOKEN_REFRESH_MARGIN", "60"))
+)
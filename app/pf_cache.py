@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Bump when the shape of the cached payload changes
+cache_schema_version = "1"
+
+
+def scenario_key(warming_scenario) -> str:
+    try:
+        return f"{float(warming_scenario):.1f}"
+    except ValueError:
+        return str(warming_scenario).strip()
+
+
+def location_key(address, country) -> str:
+    address = " ".join(str(address).lower().split())
+    country = " ".join(str(country).lower().split())
+    return f"{address}|{country}"
+
+
+def cache_key(address, country, warming_scenario) -> str:
+    """Normalize a lookup so "Miami ", "miami" and "MIAMI" share one entry."""
+    return f"{location_key(address, country)}|{scenario_key(warming_scenario)}"
+
+
+def encode(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def decode(payload: bytes) -> Any:
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+class ResultCache:
+    """
+    Two-tier cache for Probable Futures results: a bounded in-memory LRU in front of
+    a SQLite file, so popular lookups never leave the process and the rest survive a
+    restart. Entries expire after `ttl` seconds and are ignored when they were written
+    for another `version` (dataset version and cache schema).
+
+    The SQLite file is read and written on worker threads, one at a time, so a slow
+    disk never stalls the event loop. `set_many` writes all its entries in one
+    transaction.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        max_entries: int = 512,
+        ttl: float = 30 * 24 * 3600,
+        version: str = "",
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = f"{cache_schema_version}:{version}"
+        self.memory = OrderedDict()  # type: OrderedDict[str, tuple]
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None  # type: Optional[sqlite3.Connection]
+        self._db_lock = threading.Lock()
+
+    @property
+    def db(self) -> Optional[sqlite3.Connection]:
+        if self._db is None and self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            # Commits append to the write-ahead log instead of rewriting pages and
+            # only sync at checkpoints; a crash can lose the last entries, not the file
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pf_results (
+                    key TEXT PRIMARY KEY,
+                    version TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    payload BLOB NOT NULL
+                )
+                """
+            )
+            # Drop everything written for another dataset or schema version
+            self._db.execute(
+                "DELETE FROM pf_results WHERE version != ?", (self.version,)
+            )
+            self._db.commit()
+        return self._db
+
+    def is_expired(self, stored_at: float) -> bool:
+        return time.time() - stored_at > self.ttl
+
+    async def get(self, key: str) -> Optional[Any]:
+        if key in self.memory:
+            stored_at, value = self.memory[key]
+            if not self.is_expired(stored_at):
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            del self.memory[key]
+
+        if self.db is not None:
+            row = await asyncio.to_thread(self._read, key)
+            if row is not None and not self.is_expired(row[0]):
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[1]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        await self.set_many({key: value})
+
+    async def set_many(self, items: Dict[str, Any]):
+        stored_at = time.time()
+        for key, value in items.items():
+            self._remember(key, stored_at, value)
+        if items and self.db is not None:
+            await asyncio.to_thread(self._write, stored_at, items)
+
+    def _read(self, key: str) -> Optional[tuple]:
+        with self._db_lock:
+            row = self.db.execute(
+                "SELECT stored_at, payload FROM pf_results WHERE key = ? AND version = ?",
+                (key, self.version),
+            ).fetchone()
+        return (row[0], decode(row[1])) if row is not None else None
+
+    def _write(self, stored_at: float, items: Dict[str, Any]):
+        rows = [(key, self.version, stored_at, encode(value)) for key, value in items.items()]
+        with self._db_lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO pf_results VALUES (?, ?, ?, ?)", rows)
+
+    def keys(self, prefix: str):
+        """All live keys starting with `prefix`, from both tiers."""
+        keys = {
+            key
+            for key, (stored_at, value) in self.memory.items()
+            if key.startswith(prefix) and not self.is_expired(stored_at)
+        }
+        if self.db is not None:
+            with self._db_lock:
+                rows = self.db.execute(
+                    "SELECT key, stored_at FROM pf_results WHERE key >= ? AND key < ? AND version = ?",
+                    (prefix, prefix + "\uffff", self.version),
+                ).fetchall()
+            keys.update(key for key, stored_at in rows if not self.is_expired(stored_at))
+        return keys
+
+    def _remember(self, key: str, stored_at: float, value: Any):
+        self.memory[key] = (stored_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+        }
+
+
+pf_cache = ResultCache(
+    path=os.environ.get("PF_CACHE_PATH", ".cache/pf_cache.sqlite3"),
+    max_entries=int(os.environ.get("PF_CACHE_MAX_ENTRIES", "512")),
+    ttl=float(os.environ.get("PF_CACHE_TTL", str(30 * 24 * 3600))),
+    version=os.environ.get("PF_DATASET_VERSION", ""),
+)
@@ -0,0 +1,106 @@
+import os
+import time
+import importlib.util
+from typing import Dict, Optional
+
+import httpx
+
+
+class LatencyStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None  # type: Optional[float]
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else 0,
+            "min_ms": round((self.min or 0) * 1000, 1),
+            "max_ms": round(self.max * 1000, 1),
+        }
+
+
+class PFClient:
+    """
+    Shared HTTP transport for all Probable Futures traffic (auth and GraphQL).
+
+    A single httpx.AsyncClient keeps connections alive between requests so only the
+    first request to a host pays for the TCP and TLS handshakes. HTTP/2 is used when
+    asked for and the `h2` package is installed.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 20,
+        keepalive: int = 10,
+        keepalive_expiry: float = 60,
+        timeout: float = 30,
+        connect_timeout: float = 5,
+        http2: bool = False,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.latency = {}  # type: Dict[str, LatencyStats]
+        self._client = None  # type: Optional[httpx.AsyncClient]
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Module-level clients are built at import, before Chainlit starts its event
+        # loop, so anything bound to a loop (clients, locks, tasks) is created on
+        # first use instead, here and in the other singletons of the app
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout, http2=self.http2
+            )
+        return self._client
+
+    async def post(self, url: str, label: str, **kwargs) -> httpx.Response:
+        stats = self.latency.setdefault(label, LatencyStats())
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(url, **kwargs)
+        except httpx.HTTPError:
+            stats.errors += 1
+            raise
+        stats.add(time.perf_counter() - start)
+        return response
+
+    async def graphql(self, query: str, variables: dict, access_token: str):
+        return await self.post(
+            os.getenv("PF_API_URL") + "/graphql",
+            label="graphql",
+            json={"query": query, "variables": variables},
+            headers={"Authorization": "Bearer " + access_token},
+        )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        return {label: stats.to_dict() for label, stats in self.latency.items()}
+
+
+pf_http = PFClient(
+    pool_size=int(os.environ.get("PF_POOL_SIZE", "20")),
+    keepalive=int(os.environ.get("PF_POOL_KEEPALIVE", "10")),
+    timeout=float(os.environ.get("PF_TIMEOUT", "30")),
+    connect_timeout=float(os.environ.get("PF_CONNECT_TIMEOUT", "5")),
+    http2=os.environ.get("PF_HTTP2") == "true",
+)
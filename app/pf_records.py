@@ -0,0 +1,85 @@
+import json
+from typing import Iterator, List
+
+from dataset_catalog import dataset_catalog
+
+
+class DatasetStat:
+    """One row of a getDatasetStatistics response, reduced to what the stories use."""
+
+    __slots__ = ("index", "address", "country", "dataset_id", "name", "mid_value", "unit")
+
+    def __init__(self, index, address, country, dataset_id, name, mid_value, unit):
+        self.index = index
+        self.address = address
+        self.country = country
+        self.dataset_id = dataset_id
+        self.name = name
+        self.mid_value = mid_value
+        self.unit = unit
+
+    def __repr__(self):
+        return f"DatasetStat({self.name!r}, {self.mid_value!r}, {self.unit!r})"
+
+
+class StatTable:
+    """
+    A few dozen DatasetStat rows for one location.
+
+    `to_json` produces the same column-oriented layout as the DataFrame.to_json()
+    the story prompts were written against, so the model input does not change.
+    """
+
+    __slots__ = ("rows",)
+
+    columns = (
+        ("address", "address"),
+        ("country", "country"),
+        ("name", "name"),
+        ("midValue", "mid_value"),
+        ("unit", "unit"),
+    )
+
+    def __init__(self, rows: List[DatasetStat]):
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[DatasetStat]:
+        return iter(self.rows)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                column: {str(row.index): getattr(row, attribute) for row in self.rows}
+                for column, attribute in self.columns
+            },
+            separators=(",", ":"),
+        )
+
+
+def parse_statistics(data, address, country) -> StatTable:
+    """
+    Build the table from the decoded datasetStatisticsResponses, keeping only the
+    "Change" datasets that actually change.
+    """
+    rows = []
+    for item in data:
+        entry = dataset_catalog.entry(
+            item.get("datasetId"), item.get("name") or "", item.get("unit")
+        )
+        if not entry.is_change or item.get("midValue") == "0.0":
+            continue
+        rows.append(
+            DatasetStat(
+                len(rows),
+                address,
+                country,
+                entry.dataset_id,
+                entry.display_name,
+                item.get("midValue"),
+                entry.unit,
+            )
+        )
+    return StatTable(rows)
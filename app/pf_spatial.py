@@ -0,0 +1,151 @@
+import os
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from pf_cache import ResultCache, location_key, pf_cache, scenario_key
+
+
+# Coordinates closer than this are the same cell, written with float noise
+snap_tolerance = 1e-6
+
+
+def cell_id(latitude: float, longitude: float) -> str:
+    return f"{latitude:.4f},{longitude:.4f}"
+
+
+class GridIndex:
+    """
+    Grid hash over the coordinates of the cells we have data for.
+
+    Probable Futures data is gridded, so every address inside a cell resolves to the
+    same latitude/longitude. `nearest` finds the known cell closest to a coordinate by
+    only looking at the bucket it falls in and the eight around it.
+    """
+
+    def __init__(self, resolution: float):
+        self.resolution = resolution
+        self.buckets = {}  # type: Dict[Tuple[int, int], List[Tuple[float, float]]]
+
+    def bucket(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return (
+            math.floor(latitude / self.resolution),
+            math.floor(longitude / self.resolution),
+        )
+
+    def add(self, latitude: float, longitude: float):
+        points = self.buckets.setdefault(self.bucket(latitude, longitude), [])
+        if (latitude, longitude) not in points:
+            points.append((latitude, longitude))
+
+    def nearest(
+        self, latitude: float, longitude: float, max_distance: float
+    ) -> Optional[Tuple[float, float]]:
+        row, column = self.bucket(latitude, longitude)
+        best = None
+        best_distance = max_distance
+        for i in (row - 1, row, row + 1):
+            for j in (column - 1, column, column + 1):
+                for point in self.buckets.get((i, j), []):
+                    distance = math.hypot(point[0] - latitude, point[1] - longitude)
+                    if distance <= best_distance:
+                        best, best_distance = point, distance
+        return best
+
+    def __len__(self):
+        return sum(len(points) for points in self.buckets.values())
+
+
+class SpatialCache:
+    """
+    Stores Probable Futures results per grid cell instead of per address string.
+
+    An alias table maps every address we resolved to its cell, so "Brooklyn, USA" and
+    "Queens, USA" share one stored payload per warming scenario, and an address whose
+    cell is known is answered locally. An address seen for the first time is
+    answered locally too when a coordinate of it is known and falls in a cell we
+    have data for. Aliases and cell data live in the same two-tier cache as the
+    address results.
+    """
+
+    def __init__(self, cache: ResultCache, resolution: float):
+        self.cache = cache
+        self.index = GridIndex(resolution)
+        self.hits = 0
+        self.misses = 0
+        self.coordinate_hits = 0
+        self._loaded = False
+
+    def _load(self):
+        # Rebuild the grid from the cells already in the persistent cache
+        if not self._loaded:
+            self._loaded = True
+            for key in self.cache.keys("cell:"):
+                latitude, longitude = key[len("cell:") :].split("|")[0].split(",")
+                self.index.add(float(latitude), float(longitude))
+
+    async def get(self, address, country, warming_scenario) -> Optional[Any]:
+        cell = await self.cache.get("alias:" + location_key(address, country))
+        data = None
+        if cell is not None:
+            data = await self.cache.get(f"cell:{cell}|{scenario_key(warming_scenario)}")
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    async def get_by_coordinates(
+        self, address, country, latitude: float, longitude: float, warming_scenario
+    ) -> Optional[Any]:
+        """
+        Look up an address whose coordinate is known, e.g. from the gazetteer, in the
+        known cell within half a grid step of it. A hit aliases the address to that
+        cell, so its next lookup is a plain `get`.
+        """
+        self._load()
+        point = self.index.nearest(latitude, longitude, self.index.resolution / 2)
+        if point is None:
+            return None
+        cell = cell_id(*point)
+        data = await self.cache.get(f"cell:{cell}|{scenario_key(warming_scenario)}")
+        if data is not None:
+            await self.cache.set("alias:" + location_key(address, country), cell)
+            self.coordinate_hits += 1
+        return data
+
+    def entries(
+        self, address, country, warming_scenario, data: List[dict]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        The cache entries that store `data` under its cell, for `ResultCache.set_many`.
+        None when it has no coordinates.
+        """
+        if not data or data[0].get("latitude") is None:
+            return None
+        self._load()
+        latitude = float(data[0]["latitude"])
+        longitude = float(data[0]["longitude"])
+        # Snap onto a known cell so float noise does not create duplicate cells.
+        # Anything further away is another cell and must not replace its payload.
+        point = self.index.nearest(latitude, longitude, snap_tolerance)
+        if point is None:
+            point = (latitude, longitude)
+            self.index.add(latitude, longitude)
+        cell = cell_id(*point)
+        return {
+            f"cell:{cell}|{scenario_key(warming_scenario)}": data,
+            "alias:" + location_key(address, country): cell,
+        }
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coordinate_hits": self.coordinate_hits,
+            "cells": len(self.index),
+        }
+
+
+spatial_cache = SpatialCache(
+    pf_cache, resolution=float(os.environ.get("PF_GRID_RESOLUTION", "0.22"))
+)
@@ -1,8 +1,5 @@
-from tiktoken import (
-    encoding_for_model,
-    get_encoding,
-)
 from decimal import Decimal, getcontext
+from functools import lru_cache
 from openai.types.beta.threads import (
     MessageContentText,
 )
@@ -12,8 +9,12 @@ import consts
 getcontext().prec = 7
 
 
-def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
-    """Return the number of tokens used by a list of messages."""
+@lru_cache(maxsize=None)
+def token_settings(model="gpt-3.5-turbo-0613"):
+    """Return the encoding and the per-message token overhead of a model, resolved once."""
+    # tiktoken is only needed for the dev cost report, load it on first use
+    from tiktoken import encoding_for_model, get_encoding
+
     try:
         encoding = encoding_for_model(model)
     except KeyError:
@@ -32,14 +33,30 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
         tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
     elif "gpt-3.5-turbo" in model:
         print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613")
+        return token_settings("gpt-3.5-turbo-0613")
     elif "gpt-4" in model:
         print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return num_tokens_from_messages(messages, model="gpt-4-0613")
+        return token_settings("gpt-4-0613")
     else:
         raise NotImplementedError(
             f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
         )
+    return encoding, tokens_per_message
+
+
+def warm_up(model=None):
+    """
+    Load the encoding of the assistant model ahead of the first cost report.
+    The BPE file comes from TIKTOKEN_CACHE_DIR when it was prewarmed there
+    (the Docker image does this at build time), otherwise it is downloaded.
+    """
+    encoding, _ = token_settings(model or consts.assistant_model)
+    encoding.encode("warm up")
+
+
+def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
+    """Return the number of tokens used by a list of messages."""
+    encoding, tokens_per_message = token_settings(model)
     num_tokens = 0
     for message in messages:
         num_tokens += tokens_per_message
@@ -104,3 +121,40 @@ def tokens_per_user(all_messages):
     assistant_tokens = num_tokens_from_messages(assistant_messages, consts.assistant_model)
 
     return [user_tokens, assistant_tokens]
+
+
+class TokenLedger:
+    """
+    Token counts of a thread's messages, kept per message id for the session.
+
+    Messages are tokenized the first time they are seen, so the cost report of a
+    turn only pays for the new messages instead of the whole thread.
+    Totals are the same as tokens_per_user.
+    """
+
+    def __init__(self, model=None):
+        self.model = model or consts.assistant_model
+        self.counts = {}  # message id -> {"user": tokens, "assistant": tokens}
+
+    def count(self, msg):
+        counts = self.counts.get(msg.id)
+        if counts is None:
+            encoding, tokens_per_message = token_settings(self.model)
+            counts = {"user": 0, "assistant": 0}
+            for content_message in msg.content:
+                if isinstance(content_message, MessageContentText) and msg.role in counts:
+                    counts[msg.role] += tokens_per_message + len(
+                        encoding.encode(content_message.text.value)
+                    )
+            self.counts[msg.id] = counts
+        return counts
+
+    def tokens_per_user(self, all_messages):
+        user_tokens = 3  # every reply is primed with <|start|>assistant<|message|>
+        assistant_tokens = 3
+        for msg in all_messages:
+            counts = self.count(msg)
+            user_tokens += counts["user"]
+            assistant_tokens += counts["assistant"]
+
+        return [user_tokens, assistant_tokens]
@@ -0,0 +1,185 @@
+import os
+import time
+import random
+import asyncio
+from typing import Dict, List, Optional
+
+from openai import AsyncOpenAI
+from openai.types.beta.threads import Run
+
+from run_tracker import terminal_statuses
+from metrics import stage_seconds
+
+
+class RateLimiter:
+    """Token bucket shared by every caller in the process."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.waited = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            delay = (1 - self.tokens) / self.rate
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+
+class WatchedRun:
+    def __init__(self, thread_id: str, run_id: str, interval: float):
+        self.thread_id = thread_id
+        self.run_id = run_id
+        self.interval = interval
+        self.next_due = time.monotonic() + interval
+        self.status = None  # type: Optional[str]
+        self.waiters = []  # type: List[asyncio.Future]
+        self.last_waited_at = time.monotonic()
+
+
+class RunPoller:
+    """
+    One background task that checks the active runs of every session.
+
+    Sessions await `next_update` instead of running their own sleep loop. Each run
+    is checked quickly right after it is created or when something changed, and
+    backs off towards `max_interval` while it stays the same, e.g. during long tool
+    work. Intervals are jittered so runs started together spread out, and every
+    call, including the step listing done by the sessions, takes a token from one
+    process-wide rate limiter.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        min_interval: float = 0.25,
+        max_interval: float = 2.0,
+        backoff: float = 1.5,
+        jitter: float = 0.1,
+        rate: float = 20,
+    ):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.limiter = RateLimiter(rate, burst=max(1.0, rate))
+        self.runs = {}  # type: Dict[str, WatchedRun]
+        self.api_calls = 0
+        self._task = None  # type: Optional[asyncio.Task]
+        self._wakeup = None  # type: Optional[asyncio.Event]
+
+    async def next_update(self, thread_id: str, run_id: str) -> Run:
+        """Wait for the next scheduled check of a run and return it."""
+        watched = self.runs.get(run_id)
+        if watched is None:
+            watched = self.runs[run_id] = WatchedRun(
+                thread_id, run_id, self.min_interval
+            )
+        future = asyncio.get_running_loop().create_future()
+        watched.waiters.append(future)
+        watched.last_waited_at = time.monotonic()
+        self._ensure_running()
+        return await future
+
+    def activity(self, run_id: str):
+        """Check the run again soon, e.g. because its steps are still changing."""
+        watched = self.runs.get(run_id)
+        if watched is not None:
+            watched.interval = self.min_interval
+            watched.next_due = min(watched.next_due, time.monotonic() + self.min_interval)
+
+    def forget(self, run_id: str):
+        self.runs.pop(run_id, None)
+
+    def _ensure_running(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _schedule(self, watched: WatchedRun, run: Run):
+        if run.status != watched.status:
+            watched.interval = self.min_interval
+        elif run.status == "requires_action":
+            # The session is running the tools itself, nothing changes until it submits
+            watched.interval = self.max_interval
+        else:
+            watched.interval = min(self.max_interval, watched.interval * self.backoff)
+        watched.status = run.status
+        spread = random.uniform(1 - self.jitter, 1 + self.jitter)
+        watched.next_due = time.monotonic() + watched.interval * spread
+
+    async def _check(self, watched: WatchedRun):
+        waiters, watched.waiters = watched.waiters, []
+        try:
+            await self.limiter.acquire()
+            self.api_calls += 1
+            started_at = time.perf_counter()
+            run = await self.client.beta.threads.runs.retrieve(
+                thread_id=watched.thread_id, run_id=watched.run_id
+            )
+            # Not a span: this task serves every session, not one turn
+            stage_seconds.observe(time.perf_counter() - started_at, stage="run_poll")
+        except Exception as e:
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(e)
+            watched.next_due = time.monotonic() + watched.interval
+            return
+        self._schedule(watched, run)
+        for future in waiters:
+            if not future.done():
+                future.set_result(run)
+        if run.status in terminal_statuses:
+            self.forget(watched.run_id)
+
+    async def _run(self):
+        while self.runs:
+            now = time.monotonic()
+            # Runs nobody waits for are skipped, and dropped once abandoned
+            for run_id, watched in list(self.runs.items()):
+                if not watched.waiters and now - watched.last_waited_at > 300:
+                    self.forget(run_id)
+
+            due = [
+                watched
+                for watched in self.runs.values()
+                if watched.waiters and watched.next_due <= now
+            ]
+            if due:
+                await asyncio.gather(*(self._check(watched) for watched in due))
+                continue
+
+            waiting = [watched.next_due for watched in self.runs.values() if watched.waiters]
+            timeout = max(0.0, min(waiting) - now) if waiting else self.max_interval
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        return {
+            "active_runs": len(self.runs),
+            "api_calls": self.api_calls,
+            "rate_limited_wait_seconds": round(self.limiter.waited, 3),
+        }
+
+
+def create_run_poller(client: AsyncOpenAI) -> RunPoller:
+    return RunPoller(
+        client,
+        min_interval=float(os.environ.get("RUN_POLL_MIN_INTERVAL", "0.25")),
+        max_interval=float(os.environ.get("RUN_POLL_MAX_INTERVAL", "2.0")),
+        rate=float(os.environ.get("RUN_POLL_RPS", "20")),
+    )
@@ -0,0 +1,76 @@
+from typing import TYPE_CHECKING, Optional
+
+from openai import AsyncOpenAI
+from openai.types.beta.threads import Run
+
+from run_tracker import terminal_statuses
+
+if TYPE_CHECKING:
+    from run_poller import RunPoller
+
+idle = "idle"
+running = "running"
+awaiting_tool_output = "awaiting_tool_output"
+terminal = "terminal"
+
+
+class SessionRunState:
+    """
+    State of the last run a session started: idle, running, awaiting tool output
+    or terminal.
+
+    A new message can be sent right away when the session knows nothing is in
+    flight. The API is only asked when a run may still be active, and `runs.list`
+    is only used when the session does not know its run at all, for example when
+    the state was lost with a reconnect.
+    """
+
+    def __init__(self, certain: bool = True):
+        self.run_id = None  # type: Optional[str]
+        self.state = idle
+        self.certain = certain
+
+    @property
+    def is_busy(self) -> bool:
+        return self.state in (running, awaiting_tool_output)
+
+    def start(self, run_id: str):
+        self.run_id = run_id
+        self.state = running
+        self.certain = True
+
+    def update(self, run: Run):
+        if run.status in terminal_statuses:
+            self.state = terminal
+        elif run.status == "requires_action":
+            self.state = awaiting_tool_output
+        else:
+            self.state = running
+
+    async def wait_until_idle(
+        self, client: AsyncOpenAI, thread_id: str, poller: "RunPoller"
+    ):
+        """Return once no run of the thread is active, cancelling stuck tool calls."""
+        if self.certain and not self.is_busy:
+            return
+
+        if not self.certain:
+            # We do not know which run to follow, fall back to checking all of them
+            runs = await client.beta.threads.runs.list(thread_id=thread_id)
+            active = [run for run in runs.data if run.status not in terminal_statuses]
+            if not active:
+                self.state = terminal
+                self.certain = True
+                return
+            self.start(active[0].id)
+
+        while True:
+            run = await poller.next_update(thread_id, self.run_id)
+            self.update(run)
+            if self.state == awaiting_tool_output:
+                # Nobody is going to submit these outputs anymore
+                await client.beta.threads.runs.cancel(
+                    thread_id=thread_id, run_id=self.run_id
+                )
+            elif not self.is_busy:
+                return
@@ -0,0 +1,123 @@
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from openai import AsyncOpenAI
+from openai.types.beta.threads import Run, ThreadMessage
+from openai.types.beta.threads.runs import RunStep
+
+import tracing
+from pagination import list_after
+
+if TYPE_CHECKING:
+    from message_mirror import MessageMirror
+    from run_poller import RunPoller
+
+terminal_statuses = ["cancelled", "failed", "completed", "expired"]
+
+
+class RunTracker:
+    """
+    Follows the steps of a single assistant run and only returns the steps that are
+    new or still changing, so already rendered steps are not fetched again.
+
+    openai==1.3.5 has no run event streaming, so steps are fetched incrementally with
+    the `after` cursor of `runs.steps.list`. The cursor moves past every leading step
+    that has reached a terminal status and has been handed out once in that state.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        thread_id: str,
+        run_id: str,
+        poller: Optional["RunPoller"] = None,
+    ):
+        self.client = client
+        self.poller = poller
+        self.thread_id = thread_id
+        self.run_id = run_id
+        self.after = None  # type: Optional[str]
+        self.step_statuses = {}  # type: Dict[str, str]
+        self.step_types = {}  # type: Dict[str, str]
+        self.api_calls = 0
+        # What the previous polling loop would have spent for the same ticks:
+        # runs.retrieve + runs.steps.list + one steps.retrieve per step + one
+        # messages.retrieve per message step, on every tick.
+        self.legacy_api_calls = 0
+
+    @property
+    def saved_api_calls(self) -> int:
+        return self.legacy_api_calls - self.api_calls
+
+    async def retrieve_run(self) -> Run:
+        """Return the run, waiting for the shared poller's next check if there is one."""
+        self.api_calls += 1
+        self.legacy_api_calls += 1
+        if self.poller is not None:
+            return await self.poller.next_update(self.thread_id, self.run_id)
+        return await self.client.beta.threads.runs.retrieve(
+            thread_id=self.thread_id, run_id=self.run_id
+        )
+
+    async def _acquire(self):
+        # Step and message calls share the poller's request budget
+        if self.poller is not None:
+            await self.poller.limiter.acquire()
+
+    async def _list_steps(self, **params):
+        await self._acquire()
+        self.api_calls += 1
+        with tracing.span("steps_list"):
+            return await self.client.beta.threads.runs.steps.list(
+                thread_id=self.thread_id, run_id=self.run_id, **params
+            )
+
+    async def changed_steps(self) -> List[RunStep]:
+        """Return the steps that are new, still in progress or changed status."""
+        steps = await list_after(self._list_steps, self.after)  # type: List[RunStep]
+
+        changed = []  # type: List[RunStep]
+        progressed = False
+        settled = True
+        for step in steps:
+            previous_status = self.step_statuses.get(step.id)
+            is_terminal = step.status in terminal_statuses
+            if not is_terminal or previous_status != step.status:
+                changed.append(step)
+            progressed = progressed or previous_status != step.status
+            self.step_statuses[step.id] = step.status
+            self.step_types[step.id] = step.step_details.type
+
+            # Only move the cursor over a contiguous prefix of finished steps
+            if settled and is_terminal:
+                self.after = step.id
+            else:
+                settled = False
+
+        self.legacy_api_calls += 1 + len(self.step_types)
+        self.legacy_api_calls += list(self.step_types.values()).count(
+            "message_creation"
+        )
+        # New steps or status changes mean the run is moving, so check it again soon
+        if progressed and self.poller is not None:
+            self.poller.activity(self.run_id)
+        return changed
+
+    async def sync_messages(self, mirror: "MessageMirror"):
+        """Bring the session's message mirror up to date within the poller's budget."""
+        await self._acquire()
+        api_calls = mirror.api_calls
+        await mirror.sync()
+        self.api_calls += mirror.api_calls - api_calls
+
+    async def retrieve_message(self, message_id: str) -> ThreadMessage:
+        await self._acquire()
+        self.api_calls += 1
+        return await self.client.beta.threads.messages.retrieve(
+            message_id=message_id, thread_id=self.thread_id
+        )
+
+    def report(self) -> str:
+        return (
+            f"Run {self.run_id}: {self.api_calls} API calls, "
+            f"{self.saved_api_calls} saved compared to polling every step"
+        )
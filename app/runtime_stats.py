@@ -0,0 +1,59 @@
+import os
+import time
+import asyncio
+import resource
+from collections import deque
+from typing import Optional
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps `interval`.
+
+    All sessions share one event loop, so a handler that blocks it delays every
+    other session by the same amount. The recent `window` samples are kept for
+    percentiles, `max_lag` covers the whole process lifetime.
+    """
+
+    def __init__(self, interval: float = 0.1, window: int = 600):
+        self.interval = interval
+        self.samples = deque(maxlen=window)  # type: deque
+        self.max_lag = 0.0
+        self._task = None  # type: Optional[asyncio.Task]
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def stats(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0, "p50": 0.0, "p99": 0.0, "max": self.max_lag}
+        return {
+            "samples": len(samples),
+            "p50": samples[len(samples) // 2],
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "max": self.max_lag,
+        }
+
+
+def memory_bytes() -> int:
+    """Resident memory of the process, or its peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+loop_monitor = LoopLagMonitor(float(os.environ.get("LOOP_LAG_INTERVAL", "0.1")))
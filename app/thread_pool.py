@@ -0,0 +1,83 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Optional, Tuple
+
+from openai import AsyncOpenAI
+from openai.types.beta import Thread
+
+
+class ThreadPool:
+    """
+    Assistant threads created ahead of time and handed to sessions on their first
+    message.
+
+    Sessions that never send a message do not create a thread at all, and the
+    first message of the others does not wait for one: the pool keeps up to
+    `size` empty threads and refills in the background after each claim. When
+    the pool is empty a thread is created on demand, as before. Threads older
+    than `max_age` are not handed out, so a quiet process does not give out
+    threads the API may have cleaned up.
+    """
+
+    def __init__(self, client: AsyncOpenAI, size: int, max_age: float):
+        self.client = client
+        self.size = size
+        self.max_age = max_age
+        self.threads = deque()  # type: deque[Tuple[float, Thread]]
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.expired = 0
+        # At most one refill runs at a time
+        self._refill_task = None  # type: Optional[asyncio.Task]
+
+    async def claim(self) -> Thread:
+        thread = None
+        while self.threads and thread is None:
+            created_at, pooled = self.threads.popleft()
+            if time.monotonic() - created_at < self.max_age:
+                thread = pooled
+            else:
+                self.expired += 1
+
+        if thread is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            thread = await self.client.beta.threads.create()
+        self.refill()
+        return thread
+
+    def refill(self):
+        if self.size > 0 and (self._refill_task is None or self._refill_task.done()):
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        while len(self.threads) < self.size:
+            try:
+                thread = await self.client.beta.threads.create()
+            except Exception as e:
+                # The next claim tries again, or creates its thread on demand
+                print("Thread pool refill failed:", repr(e))
+                return
+            self.created += 1
+            self.threads.append((time.monotonic(), thread))
+
+    def stats(self):
+        return {
+            "pooled": len(self.threads),
+            "hits": self.hits,
+            "misses": self.misses,
+            "created": self.created,
+            "expired": self.expired,
+        }
+
+
+def create_thread_pool(client: AsyncOpenAI) -> ThreadPool:
+    return ThreadPool(
+        client,
+        size=int(os.environ.get("THREAD_POOL_SIZE", "2")),
+        max_age=float(os.environ.get("THREAD_POOL_MAX_AGE", str(24 * 3600))),
+    )
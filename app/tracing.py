@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import contextlib
+import contextvars
+from typing import List, Optional, Tuple
+
+from metrics import stage_seconds, time_to_first_token_seconds, turn_seconds, turns_total
+
+# Print every finished span as a JSON line
+trace_spans = os.environ.get("TRACE_SPANS") == "true"
+
+
+class Trace:
+    """The timed stages of one turn, from the user's message until the run ended."""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.started_at = time.perf_counter()
+        self.first_token_at = None  # type: Optional[float]
+        self.spans = []  # type: List[Tuple[str, float]]
+
+    def report(self) -> str:
+        totals = {}
+        for name, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+        stages = ", ".join("{} {:.3f}s".format(name, total) for name, total in totals.items())
+        first_token = (
+            "{:.3f}s".format(self.first_token_at - self.started_at)
+            if self.first_token_at is not None
+            else "-"
+        )
+        return "Trace {}: first token {}, {}".format(self.trace_id, first_token, stages)
+
+
+# Copied into the tasks a turn starts, so the story chains report to their turn
+current_trace = contextvars.ContextVar(
+    "current_trace", default=None
+)  # type: contextvars.ContextVar[Optional[Trace]]
+current_span = contextvars.ContextVar(
+    "current_span", default=None
+)  # type: contextvars.ContextVar[Optional[str]]
+
+
+def start_trace(trace_id: str) -> Trace:
+    trace = Trace(trace_id)
+    current_trace.set(trace)
+    return trace
+
+
+def end_trace(trace: Trace, status: str):
+    turn_seconds.observe(time.perf_counter() - trace.started_at)
+    turns_total.inc(status=status)
+
+
+def first_token():
+    """Note that answer content reached the UI; only the first call of a turn counts."""
+    trace = current_trace.get()
+    if trace is not None and trace.first_token_at is None:
+        trace.first_token_at = time.perf_counter()
+        time_to_first_token_seconds.observe(trace.first_token_at - trace.started_at)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Time a stage of the current turn and record it in `app_stage_seconds`."""
+    parent = current_span.get()
+    token = current_span.set(name)
+    started_at = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - started_at
+        current_span.reset(token)
+        stage_seconds.observe(duration, stage=name)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append((name, duration))
+        if trace_spans:
+            record = {
+                "trace": trace.trace_id if trace is not None else None,
+                "span": name,
+                "parent": parent,
+                "start": round(started_at - trace.started_at, 6) if trace is not None else None,
+                "duration": round(duration, 6),
+                "error": error,
+            }
+            record.update(attributes)
+            print(json.dumps(record))
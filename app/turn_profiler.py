@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+import functools
+import contextlib
+import contextvars
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+
+class Profile:
+    """Stack samples of one turn, in the collapsed format of flamegraph.pl."""
+
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self.stacks = Counter()  # type: Counter
+        self.samples = 0
+        self.finished = False
+
+    def add(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            # Everything below the callback the event loop is running is the loop itself
+            if code.co_name == "_run" and code.co_filename.endswith(
+                os.path.join("asyncio", "events.py")
+            ):
+                break
+            stack.append(
+                "{} ({}:{})".format(
+                    code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+                )
+            )
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(
+            "{} {}\n".format(stack, count) for stack, count in self.stacks.most_common()
+        )
+
+
+# The profile of the turn a task works for, inherited by the tasks the turn starts
+current_profile = contextvars.ContextVar(
+    "current_profile", default=None
+)  # type: contextvars.ContextVar[Optional[Profile]]
+
+
+class TurnProfiler:
+    """
+    Statistical profiler for single turns, for when one location or session is slow.
+
+    A turn is profiled when its thread was selected with `threads`, or at random
+    with `sample_rate`. While such a turn runs, a background thread looks at the
+    event loop thread every `interval` seconds and records its stack, but only
+    when the task running at that moment belongs to the turn. Other sessions
+    sharing the loop therefore do not show up. The tasks a turn starts, like the
+    story chains, are followed through a task factory. Without profiled turns
+    there is no sampling thread and no cost beyond the task factory's check.
+
+    Each profile is written to `directory` as `<thread id>-<time>.collapsed`,
+    which flamegraph.pl and speedscope read.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        interval: float = 0.005,
+        sample_rate: float = 0.0,
+        threads=(),
+    ):
+        self.directory = directory
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.threads = set(threads)
+        self.written = 0
+        self._tasks = {}  # type: Dict[asyncio.Task, Profile]
+        self._lock = threading.Lock()
+        self._sampler = None  # type: Optional[threading.Thread]
+        self._loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self._loop_thread_id = None  # type: Optional[int]
+        self._previous_factory = None
+
+    def should_profile(self, thread_id: Optional[str]) -> bool:
+        return thread_id in self.threads or random.random() < self.sample_rate
+
+    def _install(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._loop_thread_id = threading.get_ident()
+            self._previous_factory = loop.get_task_factory()
+            loop.set_task_factory(self._task_factory)
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        profile = current_profile.get()
+        if profile is not None and not profile.finished:
+            self._track(task, profile)
+        return task
+
+    def _track(self, task: asyncio.Task, profile: Profile):
+        with self._lock:
+            self._tasks[task] = profile
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample, name="turn-profiler", daemon=True
+                )
+                self._sampler.start()
+        task.add_done_callback(self._untrack)
+
+    def _untrack(self, task: asyncio.Task):
+        with self._lock:
+            self._tasks.pop(task, None)
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._tasks:
+                    self._sampler = None
+                    return
+            time.sleep(self.interval)
+            task = asyncio.current_task(self._loop)
+            profile = self._tasks.get(task)
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if profile is not None and frame is not None:
+                profile.add(frame)
+
+    @contextlib.contextmanager
+    def profile(self, thread_id: Optional[str]):
+        """Profile the current task, and the tasks it starts, if the turn is selected."""
+        if not self.should_profile(thread_id):
+            yield None
+            return
+
+        self._install()
+        profile = Profile(thread_id)
+        token = current_profile.set(profile)
+        self._track(asyncio.current_task(), profile)
+        try:
+            yield profile
+        finally:
+            profile.finished = True
+            current_profile.reset(token)
+            with self._lock:
+                for task in [t for t, p in self._tasks.items() if p is profile]:
+                    del self._tasks[task]
+            self.write(profile)
+
+    def write(self, profile: Profile):
+        if not profile.samples:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory,
+            "{}-{}.collapsed".format(profile.thread_id, int(profile.started_at * 1000)),
+        )
+        with open(path, "w") as f:
+            f.write(profile.collapsed())
+        self.written += 1
+        print("Profile of {}: {} samples in {}".format(profile.thread_id, profile.samples, path))
+
+    def profile_calls(self, thread_id: Callable[[], Optional[str]]):
+        """Decorator for a handler, profiling the calls selected for `thread_id()`."""
+
+        def decorator(handler):
+            @functools.wraps(handler)
+            async def wrapper(*args, **kwargs):
+                with self.profile(thread_id()) as profile:
+                    try:
+                        return await handler(*args, **kwargs)
+                    finally:
+                        # The first call of a session is what gives it a thread
+                        if profile is not None:
+                            profile.thread_id = thread_id() or profile.thread_id
+
+            return wrapper
+
+        return decorator
+
+    def stats(self):
+        return {"active_tasks": len(self._tasks), "written": self.written}
+
+
+turn_profiler = TurnProfiler(
+    directory=os.environ.get("PROFILE_PATH", ".cache/profiles"),
+    interval=float(os.environ.get("PROFILE_INTERVAL", "0.005")),
+    sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+    threads=[t for t in os.environ.get("PROFILE_THREADS", "").split(",") if t],
+)
@@ -0,0 +1,60 @@
+import hashlib
+from typing import Dict
+
+import chainlit as cl
+
+
+def fingerprint(content: str) -> bytes:
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+
+class MessageUpdater:
+    """
+    Sends new content of messages already on screen only when it changed.
+
+    The run loop sees the same message and tool call again on every check while a
+    step is in progress, so each message keeps a fingerprint of what the UI last
+    got and unchanged content is skipped. Content that only grew at the end, like
+    a message or code being written, is sent as the new tail through
+    `stream_token` instead of replacing the whole message.
+    """
+
+    def __init__(self):
+        self.fingerprints = {}  # type: Dict[str, bytes]
+        self.streaming = {}  # type: Dict[str, cl.Message]
+        self.suppressed = 0
+        self.deltas = 0
+        self.updates = 0
+
+    def sent(self, msg: cl.Message):
+        """Remember the content a message was sent with."""
+        self.fingerprints[msg.id] = fingerprint(msg.content or "")
+
+    async def set_content(self, msg: cl.Message, content: str):
+        new_fingerprint = fingerprint(content)
+        if self.fingerprints.get(msg.id) == new_fingerprint:
+            self.suppressed += 1
+            return
+
+        previous = msg.content or ""
+        if len(content) > len(previous) and content.startswith(previous):
+            await msg.stream_token(content[len(previous) :])
+            self.streaming[msg.id] = msg
+            self.deltas += 1
+        else:
+            msg.content = content
+            await msg.update()
+            self.streaming.pop(msg.id, None)
+            self.updates += 1
+        self.fingerprints[msg.id] = new_fingerprint
+
+    async def finish(self):
+        """End the streams left open, so the final content is persisted."""
+        for msg in self.streaming.values():
+            await msg.update()
+        self.streaming.clear()
+
+    def report(self) -> str:
+        return "ui updates: {} full, {} deltas, {} suppressed".format(
+            self.updates, self.deltas, self.suppressed
+        )